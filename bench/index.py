@@ -0,0 +1,61 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Microbenchmark of searching the local directory index.
+
+Builds a synthetic directory and times queries of different
+selectivity, from a prefix matching nearly everyone to a full name.
+Searches run on the reactor thread, so every millisecond here delays
+every other user.
+
+Run from the top directory:
+
+$ python bench/index.py [people]
+
+"""
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'molnetbot'))
+
+from index import DirectoryIndex
+
+
+FIRST = [u"Anna", u"Björn", u"Cecilia", u"David", u"Eva", u"Fredrik",
+         u"Gunilla", u"Hans", u"Ingrid", u"Johan", u"Karin", u"Lars",
+         u"Maria", u"Nils", u"Olof", u"Per", u"Åsa", u"Örjan"]
+LAST = [u"Andersson", u"Berg", u"Carlsson", u"Dahl", u"Ek", u"Forsberg",
+        u"Gustafsson", u"Holm", u"Johansson", u"Karlsson", u"Lind",
+        u"Nilsson", u"Öberg", u"Persson", u"Sandberg", u"Wallin"]
+TITLES = [u"Developer", u"Designer", u"Project manager", u"Director",
+          u"Support", u"Sales", u"Accountant"]
+QUERIES = [u"d", u"de", u"p1", u"anna", u"anna dev", u"asa oberg"]
+
+
+def directory(count, seed=1):
+    rnd = random.Random(seed)
+    people = []
+    for i in range(count):
+        first, last = rnd.choice(FIRST), rnd.choice(LAST)
+        people.append({'id': i,
+                       'name': u"%s %s" % (first, last),
+                       'title': rnd.choice(TITLES),
+                       'email': u"p%d@example.com" % i,
+                       'phone': u"+46 8 %06d" % i})
+    return people
+
+
+def main(count=30000, number=20):
+    index = DirectoryIndex()
+    index.load(directory(count))
+    for query in QUERIES:
+        seconds = min(timeit.repeat(lambda: index.search(query),
+                                    number=number, repeat=3))
+        print "%-10s %4d hits %9.3f ms/search" % (
+            query, len(index.search(query)), seconds / number * 1e3)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,97 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Microbenchmark of answering static IQ requests.
+
+Compares wokkel's VersionHandler and the XEP-0012 and XEP-0202 handlers,
+each matching requests with its own XPath observer and building the
+response as a domish element tree, with the single observer and
+precomputed responses of molnetbot.iqresponder.
+
+Run from the top directory:
+
+$ python bench/iq.py
+
+Reports CPU time per request, from dispatching the parsed request to
+the stream's observers to having the serialized response.
+
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'molnetbot'))
+
+from twisted.words.xish import domish, utility
+from wokkel.generic import VersionHandler
+
+from iqresponder import IQResponder
+from xep0012 import LastActivityHandler
+from xep0202 import EntityTimeHandler
+
+
+REQUESTS = {
+    'version': "<query xmlns='jabber:iq:version'/>",
+    'time': "<time xmlns='urn:xmpp:time'/>",
+    'last': "<query xmlns='jabber:iq:last'/>",
+}
+
+
+class Stream(utility.EventDispatcher):
+    """Stands in for both the xmlstream and the stream manager."""
+
+    def __init__(self):
+        utility.EventDispatcher.__init__(self)
+        self.sent = []
+
+    def send(self, obj):
+        if domish.IElement.providedBy(obj):
+            obj = obj.toXml().encode('utf-8')
+        self.sent.append(obj)
+
+
+def parse(xml):
+    elements = []
+    stream = domish.elementStream()
+    stream.DocumentStartEvent = lambda root: None
+    stream.ElementEvent = elements.append
+    stream.DocumentEndEvent = lambda: None
+    stream.parse("<stream xmlns='jabber:client'>" + xml)
+    return elements[0]
+
+
+def install(handlers):
+    stream = Stream()
+    for handler in handlers:
+        handler.parent = stream
+        handler.makeConnection(stream)
+        handler.connectionInitialized()
+    return stream
+
+
+def run(stream, iq):
+    iq.handled = False
+    stream.dispatch(iq)
+    del stream.sent[:]
+
+
+def main(number=20000):
+    handlers = {
+        'handlers': lambda: [VersionHandler('MolnetBot', '1.0'),
+                             LastActivityHandler(lambda: 42),
+                             EntityTimeHandler()],
+        'responder': lambda: [IQResponder('MolnetBot', '1.0', lambda: 42)],
+    }
+    for kind in sorted(REQUESTS):
+        iq = parse("<iq type='get' id='abc' from='user@example.com/Home' "
+                   "to='molnet@example.com/Hello'>%s</iq>" % REQUESTS[kind])
+        for name in sorted(handlers):
+            stream = install(handlers[name]())
+            seconds = min(timeit.repeat(lambda: run(stream, iq),
+                                        number=number, repeat=3))
+            print "%-5s %-9s %7.2f us/request" % (
+                kind, name, seconds / number * 1e6)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,464 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Load test of the whole bot.
+
+Runs the handlers set up by molnetbot.tac against an XMPP server and a
+Molnet search API that both live in this process. The fake API answers
+after a configurable latency and fails a configurable share of the
+requests. Simulated users send chat queries, subscribe requests and
+IQs (software version, entity time and last activity) with a random
+think time between them, waiting for the answer to one before sending
+the next.
+
+Run from the top directory:
+
+$ python bench/load.py --users 2000 --duration 60 --latency 0.05
+
+Stanzas go through the real XML parser and serializer of the stream,
+but no sockets are involved between the users and the bot, so the
+numbers measure the bot and not the network. The harness runs on the
+same reactor and its overhead is included in the results.
+
+Results are written as JSON to stdout, or to the file given with
+--output, so that runs on different commits can be compared. Options
+in the generated molnetbot.conf can be changed with --set, e.g.
+--set cache.max_entries=0.
+
+"""
+import gc
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from ConfigParser import ConfigParser
+from xml.sax.saxutils import escape, quoteattr
+
+TOP = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, TOP)
+
+from twisted.internet import reactor
+from twisted.python import usage
+from twisted.web import resource as web_resource, server
+from twisted.words.xish import domish
+
+
+BOT = u"molnet@bench.example/Hello"
+ADMIN = u"admin@bench.example"
+SERVER_HEADER = ("<?xml version='1.0'?>"
+                 "<stream:stream xmlns='jabber:client' "
+                 "xmlns:stream='http://etherx.jabber.org/streams' "
+                 "from='bench.example' id='bench'>")
+FIRST_NAMES = [u"Anna", u"Björn", u"Cecilia", u"David", u"Eva", u"Fredrik",
+               u"Greta", u"Hans", u"Ingrid", u"Johan", u"Karin", u"Lars",
+               u"Maria", u"Nils", u"Olof", u"Per", u"Sara", u"Tomas",
+               u"Ulla", u"Åsa"]
+LAST_NAMES = [u"Andersson", u"Berg", u"Carlsson", u"Dahl", u"Ek",
+              u"Forsberg", u"Gustafsson", u"Holm", u"Isaksson", u"Johansson",
+              u"Karlsson", u"Lind", u"Magnusson", u"Nilsson", u"Öberg"]
+IQS = {'version': "<query xmlns='jabber:iq:version'/>",
+       'time': "<time xmlns='urn:xmpp:time'/>",
+       'last': "<query xmlns='jabber:iq:last'/>"}
+IQ_KINDS = sorted(IQS)
+
+
+class Options(usage.Options):
+    optParameters = [
+        ['users', 'u', 1000, "Number of simulated users.", int],
+        ['duration', 'd', 30.0, "Seconds to send requests.", float],
+        ['think', 't', 5.0, "Mean seconds between a user's requests.",
+         float],
+        ['timeout', None, 10.0, "Seconds to wait for an answer.", float],
+        ['chat', None, 0.9, "Share of requests that are queries.", float],
+        ['subscribe', None, 0.05, "Share that are subscribe requests.",
+         float],
+        ['queries', 'q', 1000, "Number of distinct queries.", int],
+        ['latency', 'l', 0.05, "Mean API latency in seconds.", float],
+        ['error-rate', 'e', 0.0, "Share of API requests that fail.", float],
+        ['seed', None, 1, "Random seed.", int],
+        ['output', 'o', None, "Write results to this file."],
+    ]
+    optFlags = [['batch', 'b', "Use the batch API endpoint."]]
+
+    def __init__(self):
+        usage.Options.__init__(self)
+        self['set'] = []
+
+    def opt_set(self, value):
+        """Override a config option, as section.option=value."""
+
+        name, _, option_value = value.partition('=')
+        section, _, option = name.partition('.')
+        if not (section and option and _):
+            raise usage.UsageError("--set takes section.option=value")
+        self['set'].append((section, option, option_value))
+
+
+class FakeAPI(web_resource.Resource):
+    """Search and batch endpoints answering after a random latency."""
+
+    isLeaf = True
+
+    def __init__(self, latency, error_rate, rng):
+        web_resource.Resource.__init__(self)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rng = rng
+        self.stats = {'requests': 0, 'errors': 0, 'queries': 0}
+
+    def render_GET(self, request):
+        query = request.args.get('q', [''])[0].decode('utf-8')
+        return self._answer(request, lambda: hits(query), 1)
+
+    def render_POST(self, request):
+        queries = json.loads(request.content.read())['queries']
+        return self._answer(request,
+                            lambda: [hits(query) for query in queries],
+                            len(queries))
+
+    def _answer(self, request, body, queries):
+        self.stats['requests'] += 1
+        self.stats['queries'] += queries
+        delay = self.rng.expovariate(1.0 / self.latency) \
+            if self.latency > 0 else 0
+        call = reactor.callLater(delay, self._finish, request, body)
+        request.notifyFinish().addErrback(lambda reason: call.active() and
+                                          call.cancel())
+        return server.NOT_DONE_YET
+
+    def _finish(self, request, body):
+        if self.rng.random() < self.error_rate:
+            self.stats['errors'] += 1
+            request.setResponseCode(500)
+            request.write("Internal error")
+        else:
+            request.setHeader('content-type', 'application/json')
+            request.write(json.dumps(body()))
+        request.finish()
+
+
+def hits(query):
+    """Deterministic search result: 0, 4, 8 or 12 people."""
+
+    count = (hash(query) % 4) * 4
+    return [{'id': i,
+             'name': u"%s %d" % (query.title(), i),
+             'title': u"Developer",
+             'phone': u"(123) 456-%03d" % i,
+             'email': u"person%d@example.com" % i}
+            for i in xrange(count)]
+
+
+class FakeTransport(object):
+    """Transport handing everything the bot writes to the fake server."""
+
+    disconnecting = False
+
+    def __init__(self, received):
+        self.received = received
+        self.producer = None
+        self.writes = 0
+
+    def write(self, data):
+        self.writes += 1
+        self.received(data)
+
+    def writeSequence(self, data):
+        self.write(''.join(data))
+
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+
+    def unregisterProducer(self):
+        self.producer = None
+
+    def pauseProducing(self):
+        pass
+
+    def resumeProducing(self):
+        pass
+
+    def loseConnection(self):
+        self.disconnecting = True
+
+    def getPeer(self):
+        return None
+
+    def getHost(self):
+        return None
+
+
+class User(object):
+    """A simulated user sending one request at a time."""
+
+    __slots__ = ('jid', 'kind', 'started', 'timeout')
+
+    def __init__(self, jid):
+        self.jid = jid
+        self.kind = None
+        self.started = None
+        self.timeout = None
+
+
+class LoadTest(object):
+    """Drives simulated users against the bot over a fake stream."""
+
+    def __init__(self, options, xmppclient, api, rng):
+        from molnetbot.metrics import Histogram
+        self.options = options
+        self.rng = rng
+        self.api = api
+        self.queries = make_queries(options['queries'], rng)
+        self.users = dict((jid, User(jid)) for jid in
+                          (u"user%d@bench.example/load" % i
+                           for i in xrange(options['users'])))
+        self.iqs = {}
+        self.latency = dict((kind, Histogram()) for kind in
+                            ('chat', 'subscribe', 'iq'))
+        self.counts = dict((kind, {'sent': 0, 'answered': 0, 'errors': 0,
+                                   'timeouts': 0})
+                           for kind in self.latency)
+        self.sending = True
+        self.next_id = 0
+
+        self.transport = FakeTransport(self._received)
+        self.parser = domish.elementStream()
+        self.parser.DocumentStartEvent = lambda root: None
+        self.parser.ElementEvent = self._element
+        self.parser.DocumentEndEvent = lambda: None
+
+        xs = self.xs = xmppclient.factory.buildProtocol(None)
+        xs.makeConnection(self.transport)
+        # Skip TLS and authentication: with no initializers, the stream
+        # is initialized as soon as the server's stream header is read
+        xs.initializers = []
+        xs.dataReceived(SERVER_HEADER)
+
+    def start(self):
+        for user in self.users.itervalues():
+            reactor.callLater(self.rng.uniform(0, self.options['think']),
+                              self._send, user)
+        reactor.callLater(self.options['duration'], self.stop)
+
+    def stop(self):
+        self.sending = False
+        reactor.callLater(self.options['timeout'], reactor.stop)
+
+    def _send(self, user):
+        if not self.sending:
+            return
+        choice = self.rng.random()
+        if choice < self.options['chat']:
+            user.kind = 'chat'
+            stanza = u"<message type='chat' from=%s to=%s><body>%s" \
+                     u"</body></message>" % (quoteattr(user.jid),
+                                             quoteattr(BOT),
+                                             escape(self.rng.choice(
+                                                 self.queries)))
+        elif choice < self.options['chat'] + self.options['subscribe']:
+            user.kind = 'subscribe'
+            stanza = u"<presence type='subscribe' from=%s to=%s/>" % (
+                quoteattr(user.jid), quoteattr(BOT.split('/')[0]))
+        else:
+            user.kind = 'iq'
+            self.next_id += 1
+            iq_id = 'bench%d' % self.next_id
+            self.iqs[iq_id] = user
+            stanza = u"<iq type='get' id='%s' from=%s to=%s>%s</iq>" % (
+                iq_id, quoteattr(user.jid), quoteattr(BOT),
+                IQS[self.rng.choice(IQ_KINDS)])
+        self.counts[user.kind]['sent'] += 1
+        user.started = time.time()
+        user.timeout = reactor.callLater(self.options['timeout'],
+                                         self._timed_out, user)
+        self.xs.dataReceived(stanza.encode('utf-8'))
+
+    def _received(self, data):
+        self.parser.parse(data)
+
+    def _element(self, element):
+        if element.name == 'message':
+            user = self.users.get(element.getAttribute('to'))
+            if user is not None and user.kind == 'chat':
+                self._answered(user)
+        elif element.name == 'presence':
+            user = self.users.get(element.getAttribute('to'))
+            if user is not None and user.kind == 'subscribe' and \
+                    element.getAttribute('type') == 'subscribed':
+                self._answered(user)
+        elif element.name == 'iq':
+            user = self.iqs.pop(element.getAttribute('id'), None)
+            if user is not None and user.kind == 'iq':
+                self._answered(user, element.getAttribute('type') == 'error')
+
+    def _answered(self, user, error=False):
+        self.latency[user.kind].record(time.time() - user.started)
+        self.counts[user.kind]['answered'] += 1
+        if error:
+            self.counts[user.kind]['errors'] += 1
+        self._next(user)
+
+    def _timed_out(self, user):
+        user.timeout = None
+        self.counts[user.kind]['timeouts'] += 1
+        self._next(user)
+
+    def _next(self, user):
+        if user.timeout is not None and user.timeout.active():
+            user.timeout.cancel()
+        user.timeout = None
+        user.kind = None
+        reactor.callLater(self.rng.expovariate(1.0 / self.options['think']),
+                          self._send, user)
+
+    def results(self):
+        from molnetbot import metrics
+        duration = self.options['duration']
+        requests = {}
+        for kind, histogram in self.latency.iteritems():
+            requests[kind] = dict(self.counts[kind])
+            requests[kind]['per_second'] = \
+                self.counts[kind]['answered'] / duration
+            requests[kind]['latency_ms'] = percentiles(histogram)
+        lag = metrics.registry.histograms.get(
+            'molnetbot_reactor_lag_seconds')
+        return {
+            'requests': requests,
+            'answered_per_second': sum(self.counts[kind]['answered']
+                                       for kind in self.counts) / duration,
+            'reactor_lag_ms': percentiles(lag) if lag else None,
+            'writes': self.transport.writes,
+            'api': self.api.stats,
+            'counters': metrics.registry.counters,
+        }
+
+
+def make_queries(count, rng):
+    queries = FIRST_NAMES + LAST_NAMES
+    while len(queries) < count:
+        queries.append(u"%s %s" % (rng.choice(FIRST_NAMES),
+                                   rng.choice(LAST_NAMES)))
+    return queries[:count]
+
+
+def percentiles(histogram):
+    result = dict(('p%g' % q, histogram.percentile(q) * 1000)
+                  for q in (50, 90, 99, 99.9))
+    result['count'] = histogram.count
+    result['mean'] = histogram.sum / histogram.count * 1000 \
+        if histogram.count else 0.0
+    return result
+
+
+def memory():
+    """Current and peak resident set size in kB."""
+
+    current = None
+    try:
+        with open('/proc/self/statm') as statm:
+            current = int(statm.read().split()[1]) * \
+                resource.getpagesize() / 1024
+    except IOError:
+        pass
+    return {'rss_kb': current,
+            'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'gc_objects': len(gc.get_objects())}
+
+
+def commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       cwd=TOP).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_config(path, api_url, options):
+    config = ConfigParser()
+    config.read(os.path.join(TOP, 'molnetbot.conf.sample'))
+    config.set('xmpp', 'jid', BOT.encode('utf-8'))
+    config.set('notifications', 'jids', ADMIN.encode('utf-8'))
+    config.set('molnet', 'api_search_url', api_url + '/search')
+    config.set('molnet', 'api_batch_url',
+               api_url + '/batch' if options['batch'] else '')
+    config.set('cache', 'store_path', '')
+    config.set('index', 'enabled', 'no')
+    config.set('smtp', 'host', '127.0.0.1')
+    config.set('metrics', 'http_port', '0')
+    config.set('vCard', 'avatar_path',
+               os.path.join(TOP, 'media', 'avatar.jpg'))
+    config.set('debug', 'log_traffic', 'no')
+    config.set('debug', 'lag_threshold', '0')
+    for section, option, value in options['set']:
+        config.set(section, option, value)
+    with open(path, 'w') as f:
+        config.write(f)
+
+
+def main():
+    options = Options()
+    try:
+        options.parseOptions()
+    except usage.UsageError, e:
+        raise SystemExit("%s: %s\n%s" % (sys.argv[0], e, options))
+
+    rng = random.Random(options['seed'])
+    api = FakeAPI(options['latency'], options['error-rate'], rng)
+    port = reactor.listenTCP(0, server.Site(api), interface='127.0.0.1')
+    api_url = 'http://127.0.0.1:%d' % port.getHost().port
+
+    # The bot reads molnetbot.conf from the working directory
+    directory = tempfile.mkdtemp(prefix='molnetbot-bench-')
+    cwd = os.getcwd()
+    try:
+        write_config(os.path.join(directory, 'molnetbot.conf'), api_url,
+                     options)
+        os.chdir(directory)
+        started = time.time()
+        namespace = {'__file__': os.path.join(TOP, 'molnetbot.tac')}
+        execfile(namespace['__file__'], namespace)
+        startup = time.time() - started
+
+        from molnetbot.profiling import LagMonitor
+        lag_monitor = LagMonitor(threshold=options['timeout'])
+        before = memory()
+        load = LoadTest(options, namespace['xmppclient'], api, rng)
+        reactor.callWhenRunning(lag_monitor.start)
+        reactor.callWhenRunning(load.start)
+        cpu = time.clock()
+        reactor.run()
+        cpu = time.clock() - cpu
+        lag_monitor.stop()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(directory, ignore_errors=True)
+
+    results = load.results()
+    results.update({
+        'commit': commit(),
+        'options': dict((key, options[key]) for key in
+                        ('users', 'duration', 'think', 'timeout', 'chat',
+                         'subscribe', 'queries', 'latency', 'error-rate',
+                         'seed', 'batch', 'set')),
+        'startup_seconds': startup,
+        'cpu_seconds': cpu,
+        'memory_before': before,
+        'memory_after': memory(),
+    })
+    results['options']['batch'] = bool(options['batch'])
+    output = json.dumps(results, indent=2, sort_keys=True,
+                        separators=(',', ': '))
+    if options['output']:
+        with open(options['output'], 'w') as f:
+            f.write(output + '\n')
+    else:
+        print output
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Microbenchmark of reply stanza serialization.
+
+Compares building a search result reply as a domish element tree and
+serializing it, the way replies used to be sent, with rendering the
+precompiled template in molnetbot.stanzas.
+
+Run from the top directory:
+
+$ python bench/stanzas.py
+
+Reports CPU time per reply and the number of objects tracked by the
+garbage collector that each reply leaves behind until it is sent.
+
+"""
+import gc
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'molnetbot'))
+
+from twisted.words.xish import domish
+
+from results import format_text, format_html
+from stanzas import CHAT_HTML
+
+
+HITS = [{'name': u"Åsa Öberg", 'title': u"Developer",
+         'phone': u"(123) 456-789", 'email': u"asa@example.com"},
+        {'name': u"Bob Smith", 'title': u"Manager & Owner",
+         'phone': u"(123) 456-780", 'email': u"bob@example.com"}]
+TO = u"user@example.com/Home"
+FROM = u"molnet@example.com/Hello"
+TEXT = format_text(HITS)
+MARKUP = format_html(HITS)
+
+
+def build_domish():
+    reply = domish.Element((None, 'message'))
+    reply['to'] = TO
+    reply['from'] = FROM
+    reply['type'] = 'chat'
+    reply.addElement('body', content=TEXT)
+    html = domish.Element(('http://jabber.org/protocol/xhtml-im', 'html'))
+    html_body = domish.Element(('http://www.w3.org/1999/xhtml', 'body'))
+    html_body.addRawXml(MARKUP)
+    html.addChild(html_body)
+    reply.addChild(html)
+    return reply
+
+
+def serialize_domish():
+    return build_domish().toXml().encode('utf-8')
+
+
+def render_template():
+    return CHAT_HTML.render(TO, FROM, TEXT, MARKUP)
+
+
+def objects_per_reply(build, n=1000):
+    gc.collect()
+    before = len(gc.get_objects())
+    kept = [build() for i in xrange(n)]
+    after = len(gc.get_objects())
+    del kept
+    return float(after - before - 1) / n
+
+
+def main(number=20000):
+    for name, build, serialize in (('domish', build_domish, serialize_domish),
+                                   ('template', render_template,
+                                    render_template)):
+        seconds = min(timeit.repeat(serialize, number=number, repeat=3))
+        print "%-9s %7.2f us/reply %6.1f objects/reply" % (
+            name, seconds / number * 1e6, objects_per_reply(build))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+The MIT license
+
+Copyright (c) 2010 Jonas Nockert
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+---
+
+
+Activity tracking.
+
+"""
+from array import array
+
+
+class ActivityTracker(object):
+    """
+    Tracks when we last handled a stanza, globally and per user.
+
+    Recording activity is a constant time update of a timestamp and of
+    a counter in a per-minute ring buffer covering the last C{minutes}
+    minutes. Users that have been idle for longer than that are
+    forgotten once a minute.
+
+    Background work can check L{busy} to be postponed while more than
+    C{busy_threshold} stanzas per minute are handled.
+
+    """
+    def __init__(self, busy_threshold=0, minutes=60, clock=None):
+        if clock is None:
+            from twisted.internet import reactor
+            clock = reactor
+        self.busy_threshold = busy_threshold
+        self.minutes = minutes
+        self.clock = clock
+        self.started = clock.seconds()
+        self.last = None
+        self._users = {}
+        self._counts = array('L', [0] * minutes)
+        self._minute = int(self.started // 60)
+
+    def touch(self, user=None):
+        """Record activity, by user if given (a bare JID)."""
+
+        now = self.clock.seconds()
+        minute = int(now // 60)
+        if minute != self._minute:
+            self._advance(minute, now)
+        self._counts[minute % self.minutes] += 1
+        self.last = now
+        if user is not None:
+            self._users[user] = now
+
+    def _advance(self, minute, now):
+        """Clear the buckets of minutes that passed without activity."""
+
+        for passed in xrange(max(self._minute + 1, minute - self.minutes + 1),
+                             minute + 1):
+            self._counts[passed % self.minutes] = 0
+        self._minute = minute
+        self.sweep(now)
+
+    def sweep(self, now=None):
+        """Forget users idle for longer than the ring buffer covers."""
+
+        if now is None:
+            now = self.clock.seconds()
+        oldest = now - self.minutes * 60
+        idle = [user for user, last in self._users.iteritems()
+                if last < oldest]
+        for user in idle:
+            del self._users[user]
+
+    def idle(self, user=None):
+        """
+        Seconds since the last activity, by user if given.
+
+        Without any activity yet, that's the time since we started. For
+        users we haven't heard from lately, None is returned.
+
+        """
+        now = self.clock.seconds()
+        if user is not None:
+            last = self._users.get(user)
+            if last is None:
+                return None
+            return now - last
+        if self.last is None:
+            return now - self.started
+        return now - self.last
+
+    def per_minute(self):
+        """Stanzas handled per minute, oldest first, current minute last."""
+
+        minute = int(self.clock.seconds() // 60)
+        if minute != self._minute:
+            self._advance(minute, self.clock.seconds())
+        return [self._counts[(minute - back) % self.minutes]
+                for back in xrange(self.minutes - 1, -1, -1)]
+
+    def rate(self):
+        """Estimate of the stanzas handled during the last 60 seconds."""
+
+        now = self.clock.seconds()
+        minute = int(now // 60)
+        if minute != self._minute:
+            self._advance(minute, now)
+        elapsed = (now - minute * 60) / 60.0
+        return self._counts[minute % self.minutes] + \
+            self._counts[(minute - 1) % self.minutes] * (1 - elapsed)
+
+    def busy(self):
+        """Whether traffic is too heavy for background work."""
+
+        return bool(self.busy_threshold) and \
+            self.rate() > self.busy_threshold
+
+    def summary(self, user=None):
+        """Short human readable summary, for the 'activity' command."""
+
+        counts = self.per_minute()[-15:]
+        lines = ["Idle for %d s, %d stanzas during the last minute." % (
+                     self.idle(), self.rate()),
+                 "Per minute, last %d minutes: %s" % (
+                     len(counts), ' '.join(str(c) for c in counts))]
+        if user:
+            idle = self.idle(user)
+            if idle is None:
+                lines.append("%s hasn't been active lately." % user)
+            else:
+                lines.append("%s was last active %d s ago." % (user, idle))
+        return "\n".join(lines)
@@ -0,0 +1,134 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+The MIT license
+
+Copyright (c) 2010 Jonas Nockert
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+---
+
+
+XEP-0050: Ad-Hoc Commands handler for admin commands
+
+Only single stage commands are supported: executing a command runs it
+and completes with its output as a note. Arguments can be passed in the
+'args' field of a submitted data form.
+
+"""
+from twisted.internet import defer
+from twisted.words.protocols.jabber import error, jid
+from twisted.words.xish import domish
+from wokkel.subprotocols import IQHandlerMixin, XMPPHandler
+
+import config
+
+
+NS_COMMANDS = 'http://jabber.org/protocol/commands'
+NS_DISCO_ITEMS = 'http://jabber.org/protocol/disco#items'
+NS_DATA = 'jabber:x:data'
+COMMAND_LIST = '/iq[@type="get"]/query[@xmlns="' + NS_DISCO_ITEMS + \
+               '"][@node="' + NS_COMMANDS + '"]'
+COMMAND_EXECUTE = '/iq[@type="set"]/command[@xmlns="' + NS_COMMANDS + '"]'
+
+
+class AdHocCommandHandler(XMPPHandler, IQHandlerMixin):
+    """
+    XMPP subprotocol handler for admin-only ad-hoc commands.
+
+    This protocol is described in
+    U{XEP-0050<http://www.xmpp.org/extensions/xep-0050.html>}.
+
+    Commands are only listed for and executed by JIDs in
+    C{config.NOTIFY_JIDS}.
+
+    """
+    iqHandlers = {COMMAND_LIST: 'onCommandList',
+                  COMMAND_EXECUTE: 'onCommandExecute'}
+
+    def __init__(self):
+        XMPPHandler.__init__(self)
+        self.commands = {}
+
+    def addCommand(self, node, name, function):
+        """
+        Add a command.
+
+        function is called with the requesting JID and the arguments
+        string and returns the text to show, or a deferred firing with
+        it.
+
+        """
+        self.commands[node] = (name, function)
+
+    def connectionInitialized(self):
+        self.xmlstream.addObserver(COMMAND_LIST, self.handleRequest)
+        self.xmlstream.addObserver(COMMAND_EXECUTE, self.handleRequest)
+
+    def _check_admin(self, iq):
+        sender = jid.internJID(iq['from'])
+        if sender.userhost() not in config.NOTIFY_JIDS:
+            raise error.StanzaError('forbidden')
+        return sender
+
+    def onCommandList(self, iq):
+        """List available commands."""
+
+        self._check_admin(iq)
+        query = domish.Element((NS_DISCO_ITEMS, 'query'))
+        query['node'] = NS_COMMANDS
+        for node, (name, function) in sorted(self.commands.iteritems()):
+            item = query.addElement('item')
+            item['jid'] = iq['to']
+            item['node'] = node
+            item['name'] = name
+        return query
+
+    def onCommandExecute(self, iq):
+        """Execute a command."""
+
+        sender = self._check_admin(iq)
+        node = iq.command.getAttribute('node')
+        if node not in self.commands:
+            raise error.StanzaError('item-not-found')
+        if iq.command.getAttribute('action', 'execute') != 'execute':
+            raise error.StanzaError('bad-request')
+
+        name, function = self.commands[node]
+        d = defer.maybeDeferred(function, sender, self._args(iq.command))
+        d.addCallback(self._completed, node, iq.getAttribute('id', ''))
+        return d
+
+    def _args(self, command):
+        """Get the 'args' field of a submitted data form, if any."""
+
+        for form in command.elements(NS_DATA, 'x'):
+            for field in form.elements(NS_DATA, 'field'):
+                if field.getAttribute('var') == 'args':
+                    for value in field.elements(NS_DATA, 'value'):
+                        return unicode(value)
+        return u''
+
+    def _completed(self, text, node, sessionid):
+        command = domish.Element((NS_COMMANDS, 'command'))
+        command['node'] = node
+        command['sessionid'] = sessionid
+        command['status'] = 'completed'
+        command.addElement('note', content=text)['type'] = 'info'
+        return command
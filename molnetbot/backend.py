@@ -0,0 +1,454 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+The MIT license
+
+Copyright (c) 2010 Jonas Nockert
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+---
+
+
+HTTP client for the Molnet search API.
+
+Requests go through a persistent, keep-alive connection pool instead of
+opening a new connection per query. With several API endpoints
+configured, requests are routed to the endpoint with the lowest recent
+latency and may be hedged against a second endpoint.
+
+Responses are requested gzip compressed and search results are parsed
+while they stream in.
+
+"""
+from collections import deque
+import codecs
+from cStringIO import StringIO
+import json
+import math
+import urllib
+
+from twisted.internet import defer, error, protocol
+from twisted.python import failure
+from twisted.web import error as web_error
+from twisted.web.client import (Agent, ContentDecoderAgent,
+                                FileBodyProducer, GzipDecoder,
+                                HTTPConnectionPool, ResponseDone, readBody)
+from twisted.web.http import PotentialDataLoss
+from twisted.web.http_headers import Headers
+
+from results import parse_results
+
+
+class _Endpoint(object):
+    """
+    An API endpoint and its observed latency.
+
+    Latency is tracked as an exponentially weighted moving average which
+    decays towards zero while the endpoint isn't used, so that a slow
+    endpoint is eventually tried again.
+
+    """
+    __slots__ = ('url', 'ewma', 'stamp', 'active')
+
+    def __init__(self, url):
+        self.url = url
+        self.ewma = 0.0
+        self.stamp = 0.0
+        self.active = 0
+
+    def observe(self, latency, now, alpha):
+        if self.ewma == 0.0:
+            self.ewma = latency
+        else:
+            self.ewma = alpha * latency + (1 - alpha) * self.ewma
+        self.stamp = now
+
+    def score(self, now, decay):
+        """Expected latency, weighted by the number of active requests."""
+
+        ewma = self.ewma * math.exp(-(now - self.stamp) / decay)
+        return ewma * (self.active + 1)
+
+
+class _CountingConnectionPool(HTTPConnectionPool):
+    """Connection pool that keeps track of how many connections it made."""
+
+    created = 0
+
+    def _newConnection(self, key, endpoint):
+        self.created += 1
+        return HTTPConnectionPool._newConnection(self, key, endpoint)
+
+    def idle(self):
+        """Number of idle connections currently kept open."""
+
+        return sum(len(conns) for conns in self._connections.values())
+
+
+class SearchClient(object):
+    """
+    Queries the search API over pooled HTTP connections.
+
+    Each request goes to the endpoint with the lowest latency estimate.
+    Each request is cancelled if no complete response has arrived within
+    C{request_timeout} seconds.
+
+    If C{hedge} is set and there is more than one endpoint, a second
+    request is sent to the next best endpoint when the first hasn't
+    answered within the 95th percentile of recent latencies. Whichever
+    answers first is used and the other request is cancelled.
+
+    """
+    alpha = 0.3
+    decay = 30.0
+    hedge_min_samples = 20
+
+    # Called with the latency of every successful request, if set
+    on_latency = None
+
+    def __init__(self, urls, max_connections_per_host, idle_timeout,
+                 connect_timeout, request_timeout, hedge=False,
+                 reactor=None):
+        if reactor is None:
+            from twisted.internet import reactor
+        self.endpoints = [_Endpoint(url) for url in urls]
+        self.request_timeout = request_timeout
+        self.hedge = hedge
+        self.reactor = reactor
+        self.pool = _CountingConnectionPool(reactor, persistent=True)
+        self.pool.maxPersistentPerHost = max_connections_per_host
+        self.pool.cachedConnectionTimeout = idle_timeout
+        self.agent = ContentDecoderAgent(Agent(reactor,
+                                               connectTimeout=connect_timeout,
+                                               pool=self.pool),
+                                         [('gzip', GzipDecoder)])
+        self.active = 0
+        self._latencies = deque(maxlen=200)
+        self._stats = {'hedged': 0,
+                       'hedge_wins': 0}
+
+    def stats(self):
+        """Return pool, routing and hedging statistics as a dict."""
+
+        stats = {'idle': self.pool.idle(),
+                 'active': self.active,
+                 'created': self.pool.created,
+                 'p95': self.hedge_delay()}
+        stats.update(self._stats)
+        for endpoint in self.endpoints:
+            stats['ewma %s' % endpoint.url] = endpoint.ewma
+        return stats
+
+    def set_urls(self, urls):
+        """
+        Send requests to urls from now on.
+
+        Latency estimates of endpoints that are kept are kept as well.
+        Requests in flight to removed endpoints are left to finish.
+
+        """
+        known = dict((endpoint.url, endpoint) for endpoint in self.endpoints)
+        self.endpoints = [known.get(url) or _Endpoint(url) for url in urls]
+
+    def hedge_delay(self):
+        """95th percentile of recent latencies, None if too few known."""
+
+        if len(self._latencies) < self.hedge_min_samples:
+            return None
+        latencies = sorted(self._latencies)
+        return latencies[int(len(latencies) * 0.95)]
+
+    def search(self, query, on_page=None, page_size=10):
+        """
+        Send a search query to the API.
+
+        Returns a deferred that fires with a list of hits. If given,
+        on_page is called with the first page_size hits as soon as they
+        have arrived, before the rest of the response.
+
+        """
+        params = urllib.urlencode({'q': query.encode('utf-8')})
+        now = self.reactor.seconds()
+        endpoints = sorted(self.endpoints,
+                           key=lambda e: e.score(now, self.decay))
+        delay = None
+        if self.hedge and len(endpoints) > 1:
+            delay = self.hedge_delay()
+        return _HedgedRequest(self, params, endpoints[:2], delay,
+                              on_page, page_size).deferred
+
+    def get(self, url):
+        """
+        Fetch url over the connection pool, bypassing endpoint routing.
+
+        Returns a deferred that fires with the response body.
+
+        """
+        return self._fetch('GET', url, None)
+
+    def post(self, url, body, content_type='application/json'):
+        """
+        Post body to url over the connection pool.
+
+        Returns a deferred that fires with the response body.
+
+        """
+        return self._fetch('POST', url, body, content_type)
+
+    def _fetch(self, method, url, body, content_type=None):
+        headers = Headers({'User-Agent': ['MolnetBot']})
+        producer = None
+        if body is not None:
+            headers.addRawHeader('Content-Type', content_type)
+            producer = FileBodyProducer(StringIO(body))
+        d = self.agent.request(method, url, headers, producer)
+        d.addCallback(self._read_response)
+        timeout = self.reactor.callLater(self.request_timeout, d.cancel)
+        d.addBoth(self._get_done, timeout)
+        return d
+
+    def _get_done(self, result, timeout):
+        if timeout.active():
+            timeout.cancel()
+        elif isinstance(result, failure.Failure) \
+                and result.check(defer.CancelledError):
+            raise error.TimeoutError("No answer within %s seconds." %
+                                     self.request_timeout)
+        return result
+
+    def close(self):
+        """Close all idle connections. Returns a deferred."""
+
+        return self.pool.closeCachedConnections()
+
+    def _request(self, endpoint, params, on_page, page_size):
+        """Send a single search request to endpoint."""
+
+        url = "%s?%s" % (endpoint.url, params)
+        headers = Headers({'User-Agent': ['MolnetBot']})
+        d = self.agent.request('GET', url, headers)
+        d.addCallback(self._read_hits, on_page, page_size)
+
+        self.active += 1
+        endpoint.active += 1
+        timeout = self.reactor.callLater(self.request_timeout, d.cancel)
+        d.addBoth(self._request_done, endpoint, self.reactor.seconds(),
+                  timeout)
+        return d
+
+    def _read_response(self, response):
+        """Read the response body, failing on anything but 200 OK."""
+
+        d = readBody(response)
+        if response.code != 200:
+            d.addCallback(self._http_error, response)
+        return d
+
+    def _read_hits(self, response, on_page, page_size):
+        """Parse search hits from the response as they arrive."""
+
+        if response.code != 200:
+            return self._read_response(response)
+        finished = defer.Deferred(lambda d: stream.transport.stopProducing())
+        stream = _HitStream(finished, on_page, page_size)
+        response.deliverBody(stream)
+        return finished
+
+    def _http_error(self, body, response):
+        raise web_error.Error(response.code, response.phrase, body)
+
+    def _request_done(self, result, endpoint, started, timeout):
+        """
+        Record latency, clear the request timeout and translate
+        cancellations.
+
+        Failed requests count as taking the full request timeout.
+        Requests cancelled because a hedged request won are not counted.
+
+        """
+        now = self.reactor.seconds()
+        self.active -= 1
+        endpoint.active -= 1
+        if not isinstance(result, failure.Failure):
+            if timeout.active():
+                timeout.cancel()
+            self._latencies.append(now - started)
+            endpoint.observe(now - started, now, self.alpha)
+            if self.on_latency is not None:
+                self.on_latency(now - started)
+            return result
+
+        if timeout.active():
+            timeout.cancel()
+            if not result.check(defer.CancelledError):
+                endpoint.observe(self.request_timeout, now, self.alpha)
+            return result
+
+        endpoint.observe(self.request_timeout, now, self.alpha)
+        if result.check(defer.CancelledError):
+            raise error.TimeoutError("Search API did not answer within "
+                                     "%s seconds." % self.request_timeout)
+        return result
+
+
+class _HedgedRequest(object):
+    """
+    A search request that may be repeated against a second endpoint.
+
+    C{deferred} fires with the first successful response, or with the
+    failure of the last request to fail.
+
+    """
+    def __init__(self, client, params, endpoints, hedge_delay, on_page,
+                 page_size):
+        self.client = client
+        self.params = params
+        self.on_page = on_page
+        self.page_size = page_size
+        self.endpoints = endpoints
+        self.attempts = []
+        self.hedge_call = None
+        self.deferred = defer.Deferred(self._cancel)
+        self._launch()
+        if hedge_delay is not None and self.endpoints:
+            self.hedge_call = client.reactor.callLater(hedge_delay,
+                                                       self._hedge)
+
+    def _launch(self):
+        endpoint = self.endpoints.pop(0)
+        on_page = None
+        if self.on_page is not None:
+            on_page = self._page
+        attempt = self.client._request(endpoint, self.params, on_page,
+                                       self.page_size)
+        self.attempts.append(attempt)
+        attempt.addBoth(self._finished, attempt)
+
+    def _page(self, hits):
+        """Pass on the first page from whichever request gets there."""
+
+        if self.on_page is not None and not self.deferred.called:
+            on_page, self.on_page = self.on_page, None
+            on_page(hits)
+
+    def _hedge(self):
+        self.hedge_call = None
+        self.client._stats['hedged'] += 1
+        self._launch()
+
+    def _finished(self, result, attempt):
+        first = self.attempts[0] is attempt
+        self.attempts.remove(attempt)
+        if self.deferred.called:
+            return None
+
+        if isinstance(result, failure.Failure):
+            if self.attempts:
+                # The other request may still succeed
+                return None
+            self._cancel_hedge()
+            self.deferred.errback(result)
+            return None
+
+        if not first:
+            self.client._stats['hedge_wins'] += 1
+        self.deferred.callback(result)
+        self._cancel(None)
+        return None
+
+    def _cancel_hedge(self):
+        if self.hedge_call is not None:
+            self.hedge_call.cancel()
+            self.hedge_call = None
+
+    def _cancel(self, deferred):
+        """Cancel everything still pending."""
+
+        self._cancel_hedge()
+        for attempt in list(self.attempts):
+            attempt.cancel()
+
+
+class _HitStream(protocol.Protocol):
+    """
+    Incrementally parses a JSON list of hits from a response body.
+
+    Every complete hit is decoded as soon as its closing brace arrives,
+    so a large body is never held in memory as a whole. Responses using
+    the wrapped {"results": [...]} form are parsed when complete.
+
+    """
+    def __init__(self, finished, on_page, page_size):
+        self.finished = finished
+        self.on_page = on_page
+        self.page_size = page_size
+        self.hits = []
+        self._utf8 = codecs.getincrementaldecoder('utf-8')()
+        self._decoder = json.JSONDecoder()
+        self._buffer = u''
+        self._state = 'start'
+
+    def dataReceived(self, data):
+        self._buffer += self._utf8.decode(data)
+        if self._state == 'start':
+            self._buffer = self._buffer.lstrip()
+            if not self._buffer:
+                return
+            if self._buffer[0] == u'[':
+                self._buffer = self._buffer[1:]
+                self._state = 'list'
+            else:
+                self._state = 'wrapped'
+        if self._state == 'list':
+            self._parse()
+
+    def _parse(self):
+        buf = self._buffer
+        pos = 0
+        while True:
+            while pos < len(buf) and buf[pos] in u' \t\r\n,':
+                pos += 1
+            if pos == len(buf):
+                break
+            if buf[pos] == u']':
+                self._state = 'done'
+                pos = len(buf)
+                break
+            try:
+                hit, pos = self._decoder.raw_decode(buf, pos)
+            except ValueError:
+                # Incomplete hit, wait for more data
+                break
+            self.hits.append(hit)
+            if len(self.hits) == self.page_size and self.on_page:
+                self.on_page(self.hits[:])
+        self._buffer = buf[pos:]
+
+    def connectionLost(self, reason):
+        if self.finished.called:
+            # Cancelled
+            return
+        if not reason.check(ResponseDone, PotentialDataLoss):
+            self.finished.errback(reason)
+        elif self._state == 'wrapped':
+            self.finished.callback(parse_results(self._buffer))
+        elif self._state == 'list':
+            self.finished.errback(ValueError("Truncated search results."))
+        else:
+            self.finished.callback(self.hits)
@@ -0,0 +1,129 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+The MIT license
+
+Copyright (c) 2010 Jonas Nockert
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+---
+
+
+Micro-batching of backend queries.
+
+"""
+from twisted.internet import defer
+from twisted.python import failure
+
+
+class MissingResult(Exception):
+    """Raised for a query the batch response held no result for."""
+
+
+class QueryBatcher(object):
+    """
+    Collects queries for a short while and sends them as one request.
+
+    A batch is sent C{max_delay} seconds after its first query or as
+    soon as it holds C{max_size} queries. C{send_batch} is called with a
+    list of queries and must return a deferred firing with a dict from
+    query to result. Queries missing from the dict fail with
+    L{MissingResult}.
+
+    C{stats} counts batches and queries and the total time queries spent
+    waiting for their batch to be sent, so the added latency can be
+    weighed against the number of requests saved.
+
+    """
+    def __init__(self, send_batch, max_delay, max_size, clock=None):
+        if clock is None:
+            from twisted.internet import reactor
+            clock = reactor
+        self.send_batch = send_batch
+        self.max_delay = max_delay
+        self.max_size = max_size
+        self.clock = clock
+        self._batch = []
+        self._call = None
+        self.stats = {'batches': 0,
+                      'queries': 0,
+                      'missing': 0,
+                      'wait_total': 0.0}
+
+    def submit(self, query):
+        """
+        Add query to the current batch.
+
+        Returns a deferred firing with the result for query.
+
+        """
+        d = defer.Deferred()
+        self._batch.append((query, d, self.clock.seconds()))
+        if len(self._batch) >= self.max_size:
+            self.flush()
+        elif self._call is None:
+            self._call = self.clock.callLater(self.max_delay, self.flush)
+        return d
+
+    def flush(self):
+        """Send the current batch now."""
+
+        if self._call is not None:
+            if self._call.active():
+                self._call.cancel()
+            self._call = None
+
+        batch, self._batch = self._batch, []
+        if not batch:
+            return
+
+        now = self.clock.seconds()
+        self.stats['batches'] += 1
+        self.stats['queries'] += len(batch)
+        self.stats['wait_total'] += sum(now - queued
+                                        for _, _, queued in batch)
+
+        queries = []
+        for query, _, _ in batch:
+            if query not in queries:
+                queries.append(query)
+        d = defer.maybeDeferred(self.send_batch, queries)
+        d.addBoth(self._distribute, batch)
+
+    def _distribute(self, results, batch):
+        for query, d, _ in batch:
+            if isinstance(results, failure.Failure):
+                d.errback(results)
+            elif query in results:
+                d.callback(results[query])
+            else:
+                self.stats['missing'] += 1
+                d.errback(MissingResult(query))
+
+    def mean_batch_size(self):
+        if not self.stats['batches']:
+            return 0.0
+        return float(self.stats['queries']) / self.stats['batches']
+
+    def mean_wait(self):
+        """Average time in seconds a query waited for its batch."""
+
+        if not self.stats['queries']:
+            return 0.0
+        return self.stats['wait_total'] / self.stats['queries']
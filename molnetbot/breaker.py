@@ -0,0 +1,151 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+The MIT license
+
+Copyright (c) 2010 Jonas Nockert
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+---
+
+
+Circuit breaker for backend requests.
+
+"""
+from collections import deque
+
+from twisted.internet import defer
+from twisted.python import failure
+
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitOpen(Exception):
+    """Raised when a call is rejected because the circuit is open."""
+
+
+class CircuitBreaker(object):
+    """
+    Stops calling a failing backend for a while.
+
+    The outcome of the last C{window} calls is kept. A call counts as
+    failed if it errs or takes longer than C{slow_threshold} seconds.
+    When at least C{min_calls} outcomes are known and the share of
+    failures reaches C{failure_ratio} the circuit opens and calls fail
+    right away with L{CircuitOpen}. After C{reset_timeout} seconds a
+    single trial call is let through (half-open); the circuit closes if
+    it succeeds and opens again if it doesn't. Calls started before the
+    circuit opened may still finish later and are ignored until it has
+    closed again.
+
+    C{on_change} is called with the new state on every transition.
+
+    """
+    def __init__(self, failure_ratio, min_calls, window, slow_threshold,
+                 reset_timeout, on_change=None, clock=None):
+        if clock is None:
+            from twisted.internet import reactor
+            clock = reactor
+        self.failure_ratio = failure_ratio
+        self.min_calls = min_calls
+        self.slow_threshold = slow_threshold
+        self.reset_timeout = reset_timeout
+        self.on_change = on_change
+        self.clock = clock
+        self.state = CLOSED
+        self._outcomes = deque(maxlen=window)
+        self._opened_at = None
+        self._trial_pending = False
+        self.stats = {'opened': 0,
+                      'rejected': 0,
+                      'slow': 0,
+                      'trials': 0}
+
+    def set_window(self, window):
+        """Judge the last window calls, keeping the most recent outcomes."""
+
+        if window != self._outcomes.maxlen:
+            self._outcomes = deque(self._outcomes, maxlen=window)
+
+    def call(self, f, *args, **kwargs):
+        """
+        Call f(*args, **kwargs) unless the circuit is open.
+
+        Returns a deferred with the result of the call.
+
+        """
+        if self.state == OPEN:
+            if self.clock.seconds() - self._opened_at < self.reset_timeout:
+                self.stats['rejected'] += 1
+                return defer.fail(CircuitOpen())
+            self._set_state(HALF_OPEN)
+
+        trial = False
+        if self.state == HALF_OPEN:
+            if self._trial_pending:
+                self.stats['rejected'] += 1
+                return defer.fail(CircuitOpen())
+            self._trial_pending = True
+            self.stats['trials'] += 1
+            trial = True
+
+        started = self.clock.seconds()
+        d = defer.maybeDeferred(f, *args, **kwargs)
+        d.addBoth(self._record, started, trial)
+        return d
+
+    def _record(self, result, started, trial):
+        failed = isinstance(result, failure.Failure)
+        if not failed and \
+                self.clock.seconds() - started > self.slow_threshold:
+            self.stats['slow'] += 1
+            failed = True
+
+        if trial:
+            self._trial_pending = False
+            self._outcomes.clear()
+            if failed:
+                self._open()
+            else:
+                self._set_state(CLOSED)
+            return result
+
+        if self.state != CLOSED:
+            return result
+        self._outcomes.append(failed)
+        if len(self._outcomes) >= self.min_calls:
+            ratio = float(sum(self._outcomes)) / len(self._outcomes)
+            if ratio >= self.failure_ratio:
+                self._open()
+        return result
+
+    def _open(self):
+        self._opened_at = self.clock.seconds()
+        self.stats['opened'] += 1
+        self._set_state(OPEN)
+
+    def _set_state(self, state):
+        if state == self.state:
+            return
+        self.state = state
+        if self.on_change is not None:
+            self.on_change(state)
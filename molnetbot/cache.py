@@ -0,0 +1,138 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+The MIT license
+
+Copyright (c) 2010 Jonas Nockert
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+---
+
+
+Bounded result cache for search queries.
+
+Entries expire after a fixed time-to-live and the least recently used
+entry is evicted when the cache is full.
+
+"""
+from collections import OrderedDict
+
+
+def normalize_query(query):
+    """
+    Normalize a query into a cache key.
+
+    Surrounding and repeated whitespace is collapsed and case is folded
+    so that "Bob  Smith" and "bob smith" share the same entry.
+
+    """
+    return u' '.join(query.split()).lower()
+
+
+class ResultCache(object):
+    """
+    TTL + LRU cache of backend results keyed on normalized queries.
+
+    Counters for hits, misses, evictions, expirations and stale hits
+    are kept in C{self.stats} and can be read at any time.
+
+    """
+    def __init__(self, ttl, max_entries, clock=None):
+        if clock is None:
+            from twisted.internet import reactor
+            clock = reactor
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self._entries = OrderedDict()
+        self.stats = {'hits': 0,
+                      'misses': 0,
+                      'evictions': 0,
+                      'expirations': 0,
+                      'stale_hits': 0}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __delitem__(self, key):
+        del self._entries[key]
+
+    def get(self, key):
+        """
+        Return cached result for key or None if missing or expired.
+
+        A hit moves the entry to the most recently used position.
+        Expired entries are kept until evicted, see L{get_stale}.
+
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.stats['misses'] += 1
+            return None
+
+        if entry[0] <= self.clock.seconds():
+            self.stats['expirations'] += 1
+            self.stats['misses'] += 1
+            return None
+
+        del self._entries[key]
+        self._entries[key] = entry
+        self.stats['hits'] += 1
+        return entry[1]
+
+    def get_stale(self, key):
+        """
+        Return cached result for key even if it has expired.
+
+        Used to answer with possibly outdated results when the backend
+        is unavailable. Returns None if key isn't cached at all.
+
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self.stats['stale_hits'] += 1
+        return entry[1]
+
+    def put(self, key, result, expires=None):
+        """
+        Store result for key, evicting the least recently used entry.
+
+        The entry expires after the cache TTL unless an absolute
+        expiration time is given.
+
+        """
+        if self.max_entries <= 0:
+            return
+
+        if expires is None:
+            expires = self.clock.seconds() + self.ttl
+        self._entries.pop(key, None)
+        self._entries[key] = (expires, result)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def clear(self):
+        """Drop all entries. Counters are left untouched."""
+
+        self._entries.clear()
@@ -29,49 +29,222 @@ Configuration for molnetbot.
 
 Copy 'molnetbot.conf.sample' to 'molnetbot.conf' and edit options.
 
+Nothing is read on import. The bot calls L{load} at startup, which
+publishes every setting as an attribute of this module, e.g.
+C{config.JID}. L{reload} reads the file again on SIGHUP or the 'reload'
+admin command and swaps in the new settings all at once, see
+L{on_reload}.
+
 """
 from ConfigParser import ConfigParser
-import subprocess
+import os
 
+from twisted.python import log
 
-def version():
-    """Get version number as latest git tag."""
 
-    p = subprocess.Popen('git describe',
-                         shell=True,
-                         stdout=subprocess.PIPE)
-    if p.poll() != 0:
-        # Process exited with error, set version manually
-        return "na"
-    else:
-        return proc.communicate()[0].strip()
+# Settings that are only read at startup. Changing them in a running bot
+# has no effect until it's restarted.
+RESTART_REQUIRED = ('JID', 'PASSWORD', 'COMPONENT_ENABLED', 'COMPONENT_JID',
+                    'COMPONENT_HOST', 'COMPONENT_PORT', 'COMPONENT_SECRET',
+                    'HTTP_MAX_CONNECTIONS_PER_HOST', 'HTTP_IDLE_TIMEOUT',
+                    'HTTP_CONNECT_TIMEOUT', 'CACHE_STORE_PATH',
+                    'INDEX_ENABLED', 'INDEX_DIRECTORY_URL', 'WORKER_COUNT',
+                    'METRICS_HTTP_PORT', 'METRICS_HTTP_INTERFACE',
+                    'ROSTER_STORE_PATH', 'AVATAR_IMAGE_PATH',
+                    'AVATAR_CACHE_PATH', 'LOG_TRAFFIC')
+
+# Path of the configuration file, relative to the working directory
+PATH = 'molnetbot.conf'
 
-config = ConfigParser()
-config.read('molnetbot.conf')
+# The current settings, None until loaded
+settings = None
 
-# JID and password to use for this bot
-JID = config.get('xmpp', 'jid')
-PASSWORD = config.get('xmpp', 'password')
+_listeners = []
 
-# notifications configuration
-NOTIFY_JIDS = config.get('notifications', 'jids').split(' ')
-NOTIFY_ON_SUBSCRIBES = config.getboolean('notifications',
-                                         'notify_on_subscribes')
-NOTIFY_ON_UNSUBSCRIBES = config.getboolean('notifications',
-                                           'notify_on_unsubscribes')
-NOTIFY_ON_QUERIES = config.getboolean('notifications',
-                                      'notify_on_queries')
 
-# smtp configuration
-SMTP_HOST = config.get('smtp', 'host')
-EMAIL_FROM = config.get('smtp', 'from')
-EMAIL_TO = config.get('smtp', 'to').split(' ')
+def version():
+    """Version baked in at build time, see release.py."""
+
+    try:
+        from _version import VERSION
+    except ImportError:
+        return "na"
+    return VERSION
+
+
+class Settings(object):
+    """
+    All settings read from one configuration file.
+
+    Raises an error from ConfigParser if an option is missing or has
+    the wrong type, so a half-edited file is never partly applied.
+
+    """
+    def __init__(self, path):
+        parser = ConfigParser()
+        if not parser.read(path):
+            raise IOError("Can't read configuration file %r." % path)
+
+        # JID and password to use for this bot
+        self.JID = parser.get('xmpp', 'jid')
+        self.PASSWORD = parser.get('xmpp', 'password')
+
+        # XEP-0114: Connect as an external component instead
+        self.COMPONENT_ENABLED = parser.getboolean('component', 'enabled')
+        self.COMPONENT_JID = parser.get('component', 'jid')
+        self.COMPONENT_HOST = parser.get('component', 'host')
+        self.COMPONENT_PORT = parser.getint('component', 'port')
+        self.COMPONENT_SECRET = parser.get('component', 'secret')
+
+        # notifications configuration
+        self.NOTIFY_JIDS = parser.get('notifications', 'jids').split(' ')
+        self.NOTIFY_ON_SUBSCRIBES = parser.getboolean('notifications',
+                                                      'notify_on_subscribes')
+        self.NOTIFY_ON_UNSUBSCRIBES = parser.getboolean(
+            'notifications', 'notify_on_unsubscribes')
+        self.NOTIFY_ON_QUERIES = parser.getboolean('notifications',
+                                                   'notify_on_queries')
+        self.NOTIFY_DIGEST_INTERVAL = parser.getint('notifications',
+                                                    'digest_interval')
+        self.NOTIFY_DIGEST_MAX_EVENTS = parser.getint('notifications',
+                                                      'digest_max_events')
+
+        # smtp configuration
+        self.SMTP_HOST = parser.get('smtp', 'host')
+        self.EMAIL_FROM = parser.get('smtp', 'from')
+        self.EMAIL_TO = parser.get('smtp', 'to').split(' ')
+        self.SMTP_ERROR_WINDOW = parser.getint('smtp', 'error_window')
+        self.SMTP_MAX_CONCURRENT = parser.getint('smtp', 'max_concurrent')
+        self.SMTP_RETRIES = parser.getint('smtp', 'retries')
+
+        # API configuration
+        self.API_SEARCH_URLS = parser.get('molnet', 'api_search_url').split()
+        self.API_HEDGE_REQUESTS = parser.getboolean('molnet', 'hedge_requests')
+        self.API_BATCH_URL = parser.get('molnet', 'api_batch_url')
+        self.API_BATCH_MAX_DELAY = parser.getint('molnet', 'batch_max_delay')
+        self.API_BATCH_MAX_SIZE = parser.getint('molnet', 'batch_max_size')
+
+        # HTTP connection pool configuration
+        self.HTTP_MAX_CONNECTIONS_PER_HOST = parser.getint(
+            'http', 'max_connections_per_host')
+        self.HTTP_IDLE_TIMEOUT = parser.getint('http', 'idle_timeout')
+        self.HTTP_CONNECT_TIMEOUT = parser.getint('http', 'connect_timeout')
+        self.HTTP_REQUEST_TIMEOUT = parser.getint('http', 'request_timeout')
+
+        # Backend request scheduling
+        self.SCHEDULER_CONCURRENCY = parser.getint('scheduler', 'concurrency')
+        self.SCHEDULER_MAX_QUEUE = parser.getint('scheduler', 'max_queue')
+
+        # Circuit breaker for the search backend
+        self.BREAKER_FAILURE_RATIO = parser.getfloat('breaker',
+                                                     'failure_ratio')
+        self.BREAKER_MIN_CALLS = parser.getint('breaker', 'min_calls')
+        self.BREAKER_WINDOW = parser.getint('breaker', 'window')
+        self.BREAKER_SLOW_THRESHOLD = parser.getfloat('breaker',
+                                                      'slow_threshold')
+        self.BREAKER_RESET_TIMEOUT = parser.getint('breaker', 'reset_timeout')
+
+        # Per-sender rate limiting
+        self.RATELIMIT_RATE = parser.getfloat('ratelimit', 'rate')
+        self.RATELIMIT_BURST = parser.getint('ratelimit', 'burst')
+
+        # Result cache configuration
+        self.CACHE_TTL = parser.getint('cache', 'ttl')
+        self.CACHE_MAX_ENTRIES = parser.getint('cache', 'max_entries')
+        self.CACHE_STORE_PATH = parser.get('cache', 'store_path')
+
+        # Paginated delivery of search results
+        self.RESULTS_PAGE_SIZE = parser.getint('results', 'page_size')
+        self.RESULTS_MORE_TIMEOUT = parser.getint('results', 'more_timeout')
+
+        # Local directory index
+        self.INDEX_ENABLED = parser.getboolean('index', 'enabled')
+        self.INDEX_DIRECTORY_URL = parser.get('index', 'directory_url')
+        self.INDEX_SYNC_INTERVAL = parser.getint('index', 'sync_interval')
+
+        # Activity
+        self.BUSY_THRESHOLD = parser.getint('activity', 'busy_threshold')
+
+        # Workers. The index of this worker is set by worker 0 when it starts
+        # the others.
+        self.WORKER_COUNT = parser.getint('workers', 'count')
+        self.WORKER_INDEX = int(os.environ.get('MOLNETBOT_WORKER', 0))
+
+        # Metrics
+        self.METRICS_HTTP_PORT = parser.getint('metrics', 'http_port')
+        self.METRICS_HTTP_INTERFACE = parser.get('metrics', 'http_interface')
+
+        # Roster
+        self.ROSTER_STORE_PATH = parser.get('roster', 'store_path')
+        self.ROSTER_BROADCAST_RATE = parser.getfloat('roster',
+                                                     'broadcast_rate')
+        self.ROSTER_BROADCAST_BATCH = parser.getint('roster',
+                                                    'broadcast_batch')
+        if self.ROSTER_BROADCAST_RATE <= 0 or self.ROSTER_BROADCAST_BATCH < 1:
+            raise ValueError("[roster] broadcast_rate must be positive and "
+                             "broadcast_batch at least 1.")
+
+        # vCard
+        self.AVATAR_IMAGE_PATH = parser.get('vCard', 'avatar_path')
+        self.AVATAR_CACHE_PATH = parser.get('vCard', 'cache_path')
+
+        # Log traffic?
+        self.LOG_TRAFFIC = parser.getboolean('debug', 'log_traffic')
+
+        # Profiling
+        self.PROFILE_DIR = parser.get('debug', 'profile_dir')
+        self.LAG_THRESHOLD = parser.getfloat('debug', 'lag_threshold')
+
+
+def load(path=None):
+    """
+    Read the configuration file and make its settings current.
+
+    Settings in L{RESTART_REQUIRED} keep their current values, so that
+    the running bot keeps seeing the values it was started with.
+    Listeners added with L{on_reload} are called with the previous and the
+    new settings, unless this is the first load. Returns the names of
+    changed settings that need a restart to take effect.
+
+    """
+    global settings
+    new = Settings(path or PATH)
+    pending = []
+    if settings is not None:
+        for name in RESTART_REQUIRED:
+            if getattr(new, name) != getattr(settings, name):
+                pending.append(name)
+                setattr(new, name, getattr(settings, name))
+    old, settings = settings, new
+    globals().update(vars(new))
+    if old is None:
+        return []
+    for listener in _listeners:
+        listener(old, new)
+    return pending
+
+
+def reload():
+    """
+    Load the configuration file again, keeping the current settings if it
+    can't be read. Returns a line of text saying what happened.
+
+    """
+    try:
+        pending = load()
+    except Exception, e:
+        text = u"Configuration not reloaded: %s" % e
+    else:
+        if pending:
+            text = (u"Configuration reloaded, restart to apply %s." %
+                    u", ".join(pending))
+        else:
+            text = u"Configuration reloaded."
+    log.msg(text)
+    return text
 
-# API configuration
-API_SEARCH_URL = config.get('molnet', 'api_search_url')
 
-# vCard
-AVATAR_IMAGE_PATH = config.get('vCard', 'avatar_path')
+def on_reload(listener):
+    """Call listener(old, new) with the settings whenever they're reloaded."""
 
-# Log traffic?
-LOG_TRAFFIC = config.getboolean('debug', 'log_traffic')
+    _listeners.append(listener)
@@ -0,0 +1,177 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+The MIT license
+
+Copyright (c) 2010 Jonas Nockert
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+---
+
+
+Aggregated error emails for failed backend queries.
+
+"""
+from collections import Counter
+from email.mime.text import MIMEText
+import time
+
+from twisted.internet import task
+from twisted.mail.smtp import sendmail
+from twisted.python import log
+
+import config
+from scheduler import QueryScheduler
+
+
+class ErrorMailer(object):
+    """
+    Collects backend failures and mails admins at most once per window.
+
+    A mail holds the number of failed queries, the distinct error types
+    and a few sample queries. When the backend answers again after
+    failing, a "recovered" mail is sent instead, on the same schedule,
+    so a flapping backend doesn't get a pair of mails per blip. Mails
+    are delivered by at most C{concurrency} SMTP transactions at a time
+    and retried C{retries} times if delivery fails.
+
+    """
+    retry_delay = 30
+
+    def __init__(self, window, concurrency, retries, samples=10, clock=None):
+        if clock is None:
+            from twisted.internet import reactor
+            clock = reactor
+        self.window = window
+        self.retries = retries
+        self.samples = samples
+        self.clock = clock
+        self.scheduler = QueryScheduler(concurrency, max_queue=10)
+        self.failing = False
+        self._recovered = False
+        self._failure_count = 0
+        self._last_sent = None
+        self._call = None
+        self._reset()
+
+    def _reset(self):
+        self._pending = 0
+        self._first_failure = None
+        self._errors = Counter()
+        self._queries = []
+
+    def failed(self, error, query):
+        """Record a failed query. error is a Failure."""
+
+        self.failing = True
+        self._recovered = False
+        self._failure_count += 1
+        self._pending += 1
+        if self._first_failure is None:
+            self._first_failure = self.clock.seconds()
+        self._errors[error.type.__name__] += 1
+        if len(self._queries) < self.samples and query not in self._queries:
+            self._queries.append(query)
+        self._schedule()
+
+    def succeeded(self):
+        """Record a successful query, mailing admins if we recovered."""
+
+        if not self.failing:
+            return
+
+        self.failing = False
+        self._recovered = True
+        self._schedule()
+
+    def _schedule(self):
+        """Flush as soon as a window has passed since the last mail."""
+
+        if self._call is not None:
+            return
+        delay = 0
+        if self._last_sent is not None:
+            delay = max(0, self._last_sent + self.window -
+                        self.clock.seconds())
+        self._call = self.clock.callLater(delay, self.flush)
+
+    def flush(self):
+        """Mail pending failures or the recovery now, if there are any."""
+
+        self._cancel_call()
+        if self._recovered:
+            subject = "[Molnetbot] Molnet search queries are working again."
+            text = "Molnet is answering search queries again after %d " \
+                   "failed queries." % self._failure_count
+            if self._pending:
+                text += "\n\nSince the last error mail:\n\n" + \
+                        self._summary()
+            self._recovered = False
+            self._failure_count = 0
+        elif self._pending:
+            subject = "[Molnetbot] %d errors occured while sending " \
+                      "search queries to Molnet." % self._pending
+            text = self._summary()
+        else:
+            return
+        self._reset()
+        self._send(subject, text)
+
+    def _cancel_call(self):
+        if self._call is not None:
+            if self._call.active():
+                self._call.cancel()
+            self._call = None
+
+    def _summary(self):
+        since = time.strftime("%Y-%m-%d %H:%M:%S",
+                              time.localtime(self._first_failure))
+        lines = ["%d queries failed since %s." % (self._pending, since),
+                 "",
+                 "Errors:"]
+        for name, count in self._errors.most_common():
+            lines.append("  %s: %d" % (name, count))
+        lines.append("")
+        lines.append("Sample queries:")
+        for query in self._queries:
+            lines.append(u"  '%s'" % query)
+        return u"\n".join(lines)
+
+    def _send(self, subject, text):
+        self._last_sent = self.clock.seconds()
+        msg = MIMEText(text.encode('utf-8'), 'plain', 'utf-8')
+        msg['Subject'] = subject
+        msg['From'] = config.EMAIL_FROM
+        msg['To'] = ', '.join(config.EMAIL_TO)
+        d = self.scheduler.submit(self._deliver, msg.as_string(),
+                                  self.retries)
+        d.addErrback(log.err, "Failed to send error mail")
+
+    def _deliver(self, message, retries):
+        d = sendmail(config.SMTP_HOST, config.EMAIL_FROM, config.EMAIL_TO,
+                     message)
+        if retries > 0:
+            d.addErrback(self._retry, message, retries)
+        return d
+
+    def _retry(self, error, message, retries):
+        log.msg("Error mail delivery failed, retrying: %s" %
+                error.getErrorMessage())
+        return task.deferLater(self.clock, self.retry_delay,
+                               self._deliver, message, retries - 1)
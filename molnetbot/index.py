@@ -0,0 +1,372 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+The MIT license
+
+Copyright (c) 2010 Jonas Nockert
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+---
+
+
+Local in-memory index of the Molnet people directory.
+
+The directory is pulled from the API at startup and kept fresh with
+incremental updates. The directory endpoint answers with a JSON object
+
+    {"people": [...], "removed": [...], "cursor": "..."}
+
+where people are search hits with an additional 'id' member and removed
+lists ids of people no longer in the directory. Passing the cursor back
+as the 'since' parameter returns only what changed since then.
+
+"""
+from bisect import bisect_left, insort
+import heapq
+from itertools import islice
+import json
+import sys
+import time
+import unicodedata
+import urllib
+
+from twisted.internet import task, threads
+from twisted.python import log
+
+
+def fold(text):
+    """
+    Fold text for matching: lower case with diacritics removed.
+
+    "Åsa Öberg" and "asa oberg" fold to the same string.
+
+    """
+    decomposed = unicodedata.normalize('NFKD', unicode(text).lower())
+    return u''.join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def tokenize(text):
+    return fold(text).replace(u'-', u' ').split()
+
+
+class DirectoryIndex(object):
+    """
+    Token index over directory entries with prefix matching.
+
+    Every word of a person's name and title is indexed after folding.
+    A query matches people having, for each word of the query, some
+    indexed word starting with it. Queries whose words are all shorter
+    than C{min_prefix} match too many people and aren't answered.
+
+    Searches run on the reactor thread. The folded name used for
+    sorting is computed when a person is indexed, and people are also
+    kept in name order. Queries matching more than C{broad} people walk
+    that order until enough hits are found. Other queries look up the
+    matching people and pick the first ones by name, without sorting
+    them all.
+
+    """
+    fields = ('name', 'title', 'email')
+    min_prefix = 2
+    broad = 2000
+
+    def __init__(self):
+        self._people = {}
+        self._postings = {}
+        self._words = {}
+        self._keys = {}
+        self._by_name = []
+        self._tokens = []
+        self._sorted = True
+
+    def __len__(self):
+        return len(self._people)
+
+    def load(self, people):
+        """Index people, replacing the current contents."""
+
+        self._people.clear()
+        self._postings.clear()
+        self._words.clear()
+        self._keys.clear()
+        self._by_name = None
+        self.update(people, [])
+        self._by_name = sorted(self._keys.itervalues())
+
+    def update(self, people, removed):
+        """Add or replace people and remove people by id."""
+
+        for person_id in removed:
+            self._remove(person_id)
+        for person in people:
+            person_id = person['id']
+            self._remove(person_id)
+            self._people[person_id] = person
+            words = self._words[person_id] = self._person_tokens(person)
+            key = self._keys[person_id] = (fold(person.get('name', u'')),
+                                           person_id)
+            if self._by_name is not None:
+                insort(self._by_name, key)
+            for token in words:
+                postings = self._postings.get(token)
+                if postings is None:
+                    postings = self._postings[token] = set()
+                    self._sorted = False
+                postings.add(person_id)
+
+    def _remove(self, person_id):
+        if self._people.pop(person_id, None) is None:
+            return
+        key = self._keys.pop(person_id)
+        if self._by_name is not None:
+            del self._by_name[bisect_left(self._by_name, key)]
+        for token in self._words.pop(person_id):
+            postings = self._postings[token]
+            postings.discard(person_id)
+            if not postings:
+                del self._postings[token]
+                self._sorted = False
+
+    def _person_tokens(self, person):
+        tokens = set()
+        for field in self.fields:
+            if person.get(field):
+                tokens.update(tokenize(person[field]))
+        return tuple(tokens)
+
+    def _token_range(self, prefix):
+        """Indexes in the sorted tokens of tokens starting with prefix."""
+
+        if not self._sorted:
+            self._tokens = sorted(self._postings)
+            self._sorted = True
+        return (bisect_left(self._tokens, prefix),
+                bisect_left(self._tokens, prefix + u'\uffff'))
+
+    def _count(self, prefix, most):
+        """Number of people matching prefix, counting up to most."""
+
+        count = 0
+        start, end = self._token_range(prefix)
+        for token in islice(self._tokens, start, end):
+            count += len(self._postings[token])
+            if count >= most:
+                break
+        return count
+
+    def _matching(self, prefix):
+        """Ids of people with an indexed word starting with prefix."""
+
+        ids = set()
+        start, end = self._token_range(prefix)
+        for token in islice(self._tokens, start, end):
+            ids.update(self._postings[token])
+        return ids
+
+    def _matches(self, person_id, prefixes):
+        words = self._words[person_id]
+        for prefix in prefixes:
+            for word in words:
+                if word.startswith(prefix):
+                    break
+            else:
+                return False
+        return True
+
+    def _scan(self, prefixes, limit, budget):
+        """
+        Walk people in name order for the first limit matches. Returns
+        None if they weren't found among the first budget people.
+
+        """
+        hits = []
+        for key, person_id in islice(self._by_name, budget):
+            if self._matches(person_id, prefixes):
+                hits.append(self._people[person_id])
+                if len(hits) == limit:
+                    return hits
+        if budget < len(self._by_name):
+            return None
+        return hits
+
+    def search(self, query, limit=50):
+        """Return up to limit people matching query, sorted by name."""
+
+        prefixes = sorted(set(tokenize(query)), key=len, reverse=True)
+        if not prefixes or len(prefixes[0]) < self.min_prefix:
+            return []
+
+        if self._count(prefixes[0], self.broad) >= self.broad:
+            hits = self._scan(prefixes, limit, self.broad)
+            if hits is not None:
+                return hits
+
+        ids = self._matching(prefixes[0])
+        for prefix in prefixes[1:]:
+            # Intersecting sets is fast unless the word matches many more
+            # people than are left, who are then checked one by one.
+            most = 4 * len(ids)
+            if self._count(prefix, most) < most:
+                ids &= self._matching(prefix)
+            else:
+                ids = set(person_id for person_id in ids
+                          if self._matches(person_id, (prefix,)))
+        ids = heapq.nsmallest(limit, ids, key=self._keys.__getitem__)
+        return [self._people[person_id] for person_id in ids]
+
+    def footprint(self):
+        """Approximate memory used by the index in bytes."""
+
+        size = sys.getsizeof(self._people) + sys.getsizeof(self._postings) \
+               + sys.getsizeof(self._tokens) + sys.getsizeof(self._words) \
+               + sys.getsizeof(self._keys) + sys.getsizeof(self._by_name)
+        for words in self._words.itervalues():
+            size += sys.getsizeof(words)
+        for key in self._keys.itervalues():
+            size += sys.getsizeof(key) + sys.getsizeof(key[0])
+        for person in self._people.itervalues():
+            size += sys.getsizeof(person)
+            size += sum(sys.getsizeof(v) for v in person.itervalues())
+        for token, postings in self._postings.iteritems():
+            size += sys.getsizeof(token) + sys.getsizeof(postings)
+        return size
+
+
+class DirectorySync(object):
+    """
+    Keeps a L{DirectoryIndex} in sync with the directory API.
+
+    The full directory is pulled and indexed in a thread when started.
+    After that, changes are pulled every C{interval} seconds. Until the
+    first pull is done C{index} is None.
+
+    Pulling changes is postponed while C{busy} returns true, but for no
+    more than C{max_skips} intervals in a row.
+
+    """
+    max_skips = 5
+
+    def __init__(self, client, url, interval, busy=None, clock=None):
+        if clock is None:
+            from twisted.internet import reactor
+            clock = reactor
+        self.client = client
+        self.url = url
+        self.interval = interval
+        self.busy = busy
+        self.index = None
+        self.cursor = None
+        self.stats = {'entries': 0,
+                      'build_time': None,
+                      'footprint': None,
+                      'syncs': 0,
+                      'sync_errors': 0,
+                      'skipped': 0}
+        self._skips = 0
+        self._loop = task.LoopingCall(self.sync)
+        self._loop.clock = clock
+        self._syncing = False
+
+    def start(self):
+        """Start pulling the directory."""
+
+        self._loop.start(self.interval)
+
+    def set_interval(self, interval):
+        """
+        Pull every interval seconds from now on.
+
+        While a pull is running, the loop is waiting for it and schedules
+        the next one with the new interval once it's done. Restarting the
+        loop then would start a second pull alongside it.
+
+        """
+        self.interval = interval
+        if not self._loop.running:
+            return
+        if self._syncing:
+            self._loop.interval = interval
+        else:
+            self._loop.stop()
+            self._loop.start(interval, now=False)
+
+    def stop(self):
+        if self._loop.running:
+            self._loop.stop()
+
+    def sync(self):
+        """Pull the full directory or changes since the last pull."""
+
+        if self._syncing:
+            return
+        if self.index is not None and self.busy is not None and \
+                self._skips < self.max_skips and self.busy():
+            self._skips += 1
+            self.stats['skipped'] += 1
+            return
+        self._skips = 0
+        self._syncing = True
+
+        url = self.url
+        if self.cursor is not None:
+            url += "?" + urllib.urlencode({'since': self.cursor})
+        d = self.client.get(url)
+        if self.index is None:
+            d.addCallback(lambda body: threads.deferToThread(self._build,
+                                                             body))
+            d.addCallback(self._built)
+        else:
+            d.addCallback(self._apply)
+        d.addErrback(self._failed)
+        d.addBoth(self._done)
+        return d
+
+    def _build(self, body):
+        """Parse and index the full directory. Runs in a thread."""
+
+        started = time.time()
+        data = json.loads(body)
+        index = DirectoryIndex()
+        index.load(data.get('people', []))
+        build_time = time.time() - started
+        return index, data.get('cursor'), build_time, index.footprint()
+
+    def _built(self, result):
+        index, cursor, build_time, footprint = result
+        self.index = index
+        self.cursor = cursor
+        self.stats.update(entries=len(index),
+                          build_time=build_time,
+                          footprint=footprint)
+        log.msg("Directory index built: %d entries in %.2f s, about "
+                "%d kB." % (len(index), build_time, footprint / 1024))
+
+    def _apply(self, body):
+        data = json.loads(body)
+        self.index.update(data.get('people', []), data.get('removed', []))
+        self.cursor = data.get('cursor', self.cursor)
+        self.stats['syncs'] += 1
+        self.stats['entries'] = len(self.index)
+
+    def _failed(self, error):
+        self.stats['sync_errors'] += 1
+        log.err(error, "Directory sync failed")
+
+    def _done(self, result):
+        self._syncing = False
@@ -0,0 +1,198 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+The MIT license
+
+Copyright (c) 2010 Jonas Nockert
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+---
+
+
+Fast path for IQ requests with (nearly) static answers.
+
+"""
+import calendar
+import time
+
+from twisted.words.protocols.jabber.xmlstream import toResponse
+from twisted.words.xish.domish import escapeToXml
+from wokkel.subprotocols import XMPPHandler
+
+import metrics
+from stanzas import IQ_RESULT
+from xep0012 import NS_LAST_ACTIVITY
+from xep0202 import NS_ENTITY_TIME
+
+
+NS_DISCO_INFO = 'http://jabber.org/protocol/disco#info'
+NS_VERSION = 'jabber:iq:version'
+IQ_GET = '/iq[@type="get"]'
+
+
+def utc_offset(timestamp):
+    """Offset of local time from UTC in seconds at timestamp."""
+
+    return calendar.timegm(time.localtime(timestamp)) - int(timestamp)
+
+
+def next_offset_change(timestamp, horizon=366 * 86400):
+    """
+    First second after timestamp when the offset from UTC changes.
+
+    Steps a day at a time and bisects the day of the change. If there is
+    no change within horizon seconds, timestamp + horizon is returned.
+
+    """
+    low = int(timestamp)
+    offset = utc_offset(low)
+    for high in xrange(low + 86400, low + horizon + 1, 86400):
+        if utc_offset(high) != offset:
+            while high - low > 1:
+                middle = (low + high) // 2
+                if utc_offset(middle) == offset:
+                    low = middle
+                else:
+                    high = middle
+            return high
+        low = high
+    return int(timestamp) + horizon
+
+
+def format_offset(offset):
+    """Format an offset in seconds as e.g. +01:00 or -03:30."""
+
+    sign = '-' if offset < 0 else '+'
+    minutes = abs(offset) // 60
+    return "%s%02d:%02d" % (sign, minutes // 60, minutes % 60)
+
+
+class IQResponder(XMPPHandler):
+    """
+    Answers IQ gets for software version, entity time, last activity and
+    service discovery info.
+
+    These protocols are described in
+    U{XEP-0092<http://xmpp.org/extensions/xep-0092.html>},
+    U{XEP-0202<http://xmpp.org/extensions/xep-0202.html>},
+    U{XEP-0012<http://xmpp.org/extensions/xep-0012.html>} and
+    U{XEP-0030<http://xmpp.org/extensions/xep-0030.html>}.
+
+    One observer matches all IQ gets and the namespace and name of the
+    child element are looked up in a dict. Answers are rendered from
+    payloads serialized in advance into the L{IQ_RESULT} template. The
+    entity time payload is rebuilt at most once per second, and the
+    timezone offset only when it changes, e.g. for daylight saving time.
+
+    Last activity answers with C{get_last()}, the seconds since the bot
+    last handled a stanza from anyone. That is the bot's global idle
+    time, the same whoever asks, not the time since the requester was
+    last heard from.
+
+    Requests for anything else, and disco#info requests for a node, are
+    left to other handlers.
+
+    """
+    def __init__(self, name, version, get_last, features=(),
+                 identity=('client', 'bot'), clock=None):
+        XMPPHandler.__init__(self)
+        if clock is None:
+            from twisted.internet import reactor
+            clock = reactor
+        self.get_last = get_last
+        self.clock = clock
+        self._version = (
+            u'<query xmlns="%s"><name>%s</name><version>%s</version>'
+            u'</query>' % (NS_VERSION, escapeToXml(name),
+                           escapeToXml(version))).encode('utf-8')
+        features = sorted(set([NS_DISCO_INFO, NS_VERSION, NS_ENTITY_TIME,
+                               NS_LAST_ACTIVITY]) | set(features))
+        self._disco_info = (
+            u'<query xmlns="%s"><identity category="%s" type="%s" '
+            u'name="%s"/>%s</query>' % (
+                NS_DISCO_INFO, identity[0], identity[1],
+                escapeToXml(name, isattrib=1),
+                u''.join(u'<feature var="%s"/>' % escapeToXml(feature,
+                                                              isattrib=1)
+                         for feature in features))).encode('utf-8')
+        self._second = None
+        self._time = None
+        self._tzo = None
+        self._tzo_until = 0
+        self._responders = {(NS_VERSION, 'query'): self._get_version,
+                            (NS_ENTITY_TIME, 'time'): self._get_time,
+                            (NS_LAST_ACTIVITY, 'query'): self._get_last,
+                            (NS_DISCO_INFO, 'query'): self._get_disco_info}
+
+    def connectionInitialized(self):
+        self.xmlstream.addObserver(IQ_GET, self.onGet, priority=1)
+
+    @metrics.timed('molnetbot_iq_static')
+    def onGet(self, iq):
+        """Answer the request if it's one of ours."""
+
+        if iq.handled:
+            return
+        request = iq.firstChildElement()
+        if request is None:
+            return
+        responder = self._responders.get((request.uri, request.name))
+        if responder is None:
+            return
+        payload = responder(request)
+        if payload is None:
+            return
+
+        iq.handled = True
+        sender = iq.getAttribute('from')
+        recipient = iq.getAttribute('to')
+        identifier = iq.getAttribute('id')
+        if sender is None or recipient is None or identifier is None:
+            response = toResponse(iq, 'result')
+            response.addRawXml(payload.decode('utf-8'))
+            self.send(response)
+        else:
+            self.send(IQ_RESULT.render(sender, recipient, identifier,
+                                       payload))
+
+    def _get_version(self, request):
+        return self._version
+
+    def _get_disco_info(self, request):
+        if request.getAttribute('node'):
+            return None
+        return self._disco_info
+
+    def _get_last(self, request):
+        return '<query xmlns="%s" seconds="%d"/>' % (NS_LAST_ACTIVITY,
+                                                     self.get_last())
+
+    def _get_time(self, request):
+        now = self.clock.seconds()
+        second = int(now)
+        if second != self._second:
+            if now >= self._tzo_until:
+                self._tzo = format_offset(utc_offset(now))
+                self._tzo_until = next_offset_change(now)
+            self._second = second
+            self._time = '<time xmlns="%s"><tzo>%s</tzo><utc>%s</utc>' \
+                         '</time>' % (NS_ENTITY_TIME, self._tzo,
+                                      time.strftime("%Y-%m-%dT%H:%M:%SZ",
+                                                    time.gmtime(second)))
+        return self._time
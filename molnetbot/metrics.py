@@ -0,0 +1,210 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+The MIT license
+
+Copyright (c) 2010 Jonas Nockert
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+---
+
+
+Counters and latency histograms.
+
+Metrics are kept in the module level registry and can be rendered in
+the Prometheus text exposition format, served over HTTP by
+L{MetricsResource}.
+
+"""
+from functools import wraps
+import math
+import time
+
+from twisted.web import resource
+
+
+class Histogram(object):
+    """
+    Log-linear latency histogram in the style of HdrHistogram.
+
+    Every power of two between C{lowest} and C{highest} seconds is split
+    into C{sub_buckets} linear buckets, so recording a value is a
+    constant time bucket increment and percentiles are accurate to
+    within 1 / sub_buckets of the value.
+
+    """
+    def __init__(self, lowest=1e-6, highest=100.0, sub_buckets=8):
+        self.lowest = lowest
+        self.sub_buckets = sub_buckets
+        self.octaves = int(math.ceil(math.log(highest / lowest, 2)))
+        self.counts = [0] * (self.octaves * sub_buckets + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def record(self, value):
+        self.count += 1
+        self.sum += value
+        self.counts[self._index(value)] += 1
+
+    def _index(self, value):
+        if value < self.lowest:
+            return 0
+        mantissa, exponent = math.frexp(value / self.lowest)
+        index = (exponent - 1) * self.sub_buckets + \
+                int((mantissa * 2 - 1) * self.sub_buckets) + 1
+        return min(index, len(self.counts) - 1)
+
+    def _upper_bound(self, index):
+        if index == 0:
+            return self.lowest
+        octave, sub = divmod(index - 1, self.sub_buckets)
+        return self.lowest * 2 ** octave * \
+               (1 + float(sub + 1) / self.sub_buckets)
+
+    def percentile(self, q):
+        """Upper bound of the bucket holding the q-th percentile."""
+
+        if not self.count:
+            return 0.0
+        rank = q / 100.0 * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return self._upper_bound(index)
+        return self._upper_bound(len(self.counts) - 1)
+
+
+class Registry(object):
+    """
+    Named counters, histograms and gauges.
+
+    Gauges are functions returning the current value and are only
+    called when metrics are rendered. Functions returning totals kept
+    elsewhere, such as cache statistics, are registered as gauges of
+    kind 'counter'.
+
+    """
+    quantiles = (50, 90, 99)
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self.help = {}
+
+    def inc(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, name, seconds):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.record(seconds)
+
+    def gauge(self, name, function, help=None, kind='gauge'):
+        self.gauges[name] = (function, kind)
+        if help:
+            self.help[name] = help
+
+    def describe(self, name, help):
+        self.help[name] = help
+
+    def render(self):
+        """Render all metrics in the Prometheus text format."""
+
+        lines = []
+        for name in sorted(self.counters):
+            self._header(lines, name, 'counter')
+            lines.append("%s %d" % (name, self.counters[name]))
+        for name in sorted(self.gauges):
+            function, kind = self.gauges[name]
+            self._header(lines, name, kind)
+            lines.append("%s %s" % (name, float(function())))
+        for name in sorted(self.histograms):
+            histogram = self.histograms[name]
+            self._header(lines, name, 'summary')
+            for q in self.quantiles:
+                lines.append('%s{quantile="%s"} %.6f' %
+                             (name, q / 100.0, histogram.percentile(q)))
+            lines.append("%s_sum %.6f" % (name, histogram.sum))
+            lines.append("%s_count %d" % (name, histogram.count))
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """Short human readable summary of counters and latencies."""
+
+        lines = ["%s: %d" % (name, self.counters[name])
+                 for name in sorted(self.counters)]
+        for name in sorted(self.gauges):
+            lines.append("%s: %s" % (name, self.gauges[name][0]()))
+        for name in sorted(self.histograms):
+            histogram = self.histograms[name]
+            lines.append("%s: n=%d p50=%.1fms p99=%.1fms" % (
+                name, histogram.count,
+                histogram.percentile(50) * 1000,
+                histogram.percentile(99) * 1000))
+        return "\n".join(lines)
+
+    def _header(self, lines, name, kind):
+        if name in self.help:
+            lines.append("# HELP %s %s" % (name, self.help[name]))
+        lines.append("# TYPE %s %s" % (name, kind))
+
+
+registry = Registry()
+inc = registry.inc
+observe = registry.observe
+gauge = registry.gauge
+
+
+def timed(name):
+    """
+    Decorator recording calls and their duration.
+
+    Counts calls in C{name}_total and records the time spent in the call
+    in the histogram C{name}_seconds.
+
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            started = time.time()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                registry.counters[name + '_total'] = \
+                    registry.counters.get(name + '_total', 0) + 1
+                observe(name + '_seconds', time.time() - started)
+        return wrapper
+    return decorator
+
+
+class MetricsResource(resource.Resource):
+    """Serves the registry in the Prometheus text format."""
+
+    isLeaf = True
+
+    def __init__(self, registry=registry):
+        resource.Resource.__init__(self)
+        self.registry = registry
+
+    def render_GET(self, request):
+        request.setHeader('Content-Type', 'text/plain; version=0.0.4')
+        return self.registry.render()
@@ -24,32 +24,57 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 THE SOFTWARE.
 
 """
+from collections import OrderedDict
+import json
 import re
 import sys
 import time
 import urllib
 
-from email.mime.text import MIMEText
-from twisted.mail.smtp import sendmail
-from twisted.web import client
-from twisted.words.xish import domish
+from twisted.python import log
+from twisted.words.protocols.jabber import jid
+from twisted.words.xish.domish import escapeToXml
 from wokkel.xmppim import (MessageProtocol, AvailablePresence,
                            PresenceProtocol)
 
 import config
+import metrics
+from backend import SearchClient
+from batching import QueryBatcher
+from breaker import CircuitBreaker, CircuitOpen, CLOSED, OPEN
+from cache import ResultCache, normalize_query
+from errormail import ErrorMailer
+from index import DirectorySync
+from ratelimit import RateLimiter, ALLOWED, NOTIFY
+from results import parse_batch_results, format_text, format_html
+from scheduler import QueryScheduler, QueueFull
+from singleflight import SingleFlight
+from roster import PacedBroadcast
+from stanzas import CHAT, CHAT_HTML, PRESENCE, SUBSCRIBED
+from store import AnswerStore
+import workers
 
+STALE_NOTE = u" (Molnet is not answering right now, this may be out of date.)"
 
-def _build_notification(content):
-    """Builds an xmpp notification element for sending out to admins."""
 
-    notification = domish.Element((None, 'message'))
-    notification['from'] = config.JID
-    # type 'headline' is more appropriate really but headlines
-    # are often displayed in a dialog so that's not cool
-    notification['type'] = 'chat'
-    notification.addElement('body', content=content)
-    return notification
-    
+def _build_reply(to, sender, content):
+    """Builds a plain text chat message, serialized."""
+
+    return CHAT.render(to, sender, content)
+
+
+class _Waiter(object):
+    """A sender waiting for the result of a backend query."""
+
+    __slots__ = ('query', 'sender', 'recipient', 'sent', 'started')
+
+    def __init__(self, query, sender, recipient):
+        self.query = query
+        self.sender = sender
+        self.recipient = recipient
+        self.sent = 0
+        self.started = time.time()
+
 
 class PresenceAcceptingHandler(PresenceProtocol):
     """
@@ -57,11 +82,80 @@ class PresenceAcceptingHandler(PresenceProtocol):
 
     This handler blindly accepts incoming presence subscription requests,
     confirms unsubscription requests and responds to presence probes.
+    Each subscription request is answered in a single write.
+
+    Admin notifications go through the shared notifier, see
+    L{NotificationDigest}.
+
+    When running as several workers, subscriptions are only handled by
+    the worker handling the contact, see L{WorkerRouter}.
 
-    Note that this handler does not remember any contacts, so it will not
-    send presence when starting.
+    Subscribed contacts are recorded in the roster, if given, see
+    L{RosterStore}. When connected as a component, the server keeps no
+    roster for us, so we send our presence to every contact in it
+    whenever we connect, most recently seen first and paced to stay
+    under the server's limits, see L{PacedBroadcast}.
+
+    Subscription handling counts as activity, see L{ActivityTracker}.
 
     """
+    def __init__(self, notifier, router=None, activity=None, roster=None):
+        PresenceProtocol.__init__(self)
+        self.notifier = notifier
+        self.router = router
+        self.activity = activity
+        self.roster = roster
+        self._broadcast = None
+
+    def connectionInitialized(self):
+        PresenceProtocol.connectionInitialized(self)
+        if self.roster is not None and config.COMPONENT_ENABLED:
+            self.roster.when_loaded().addCallback(self._announce)
+
+    def connectionLost(self, reason):
+        PresenceProtocol.connectionLost(self, reason)
+        if self._broadcast is not None:
+            self._broadcast.stop()
+            self._broadcast = None
+
+    def _announce(self, contacts):
+        """Send available presence to everyone in the roster."""
+
+        if self.xmlstream is None or self._broadcast is not None:
+            return
+        recent = sorted(contacts.iteritems(), key=lambda item: -item[1][1])
+        stanzas = [PRESENCE.render(contact, own, u"Hej!")
+                   for contact, (own, last_seen) in recent
+                   if self._owns(jid.internJID(contact))]
+        self._broadcast = PacedBroadcast(stanzas, self.send,
+                                         config.ROSTER_BROADCAST_RATE,
+                                         config.ROSTER_BROADCAST_BATCH)
+        d = self._broadcast.start()
+        d.addCallback(self._announced)
+
+    def _announced(self, count):
+        self._broadcast = None
+        log.msg("Sent presence to %d contacts." % count)
+
+    def _owns(self, entity):
+        return self.router is None or self.router.owns(entity)
+
+    def _touch(self, entity):
+        if self.activity is not None:
+            self.activity.touch(entity.userhost())
+        if self.roster is not None:
+            self.roster.seen(entity.userhost())
+
+    def _remember(self, presence):
+        if self.roster is not None:
+            self.roster.add(presence.sender.userhost(),
+                            presence.recipient.full())
+
+    def _forget(self, presence):
+        if self.roster is not None:
+            self.roster.remove(presence.sender.userhost())
+
+    @metrics.timed('molnetbot_presence_subscribed')
     def subscribedReceived(self, presence):
         """
         Subscription approval confirmation was received.
@@ -70,10 +164,14 @@ class PresenceAcceptingHandler(PresenceProtocol):
         notifications if configured for it.
 
         """
+        if not self._owns(presence.sender):
+            return
+        self._touch(presence.sender)
         if config.NOTIFY_ON_SUBSCRIBES:
             content = "%s subscribed." % presence.sender.full()
-            self._notify(content)
+            self.notifier.notify('subscribed', content)
 
+    @metrics.timed('molnetbot_presence_unsubscribed')
     def unsubscribedReceived(self, presence):
         """
         Unsubscription confirmation was received.
@@ -82,30 +180,39 @@ class PresenceAcceptingHandler(PresenceProtocol):
         notifications if configured for it.
 
         """
+        if not self._owns(presence.sender):
+            return
+        self._touch(presence.sender)
         if config.NOTIFY_ON_UNSUBSCRIBES:
             content = "%s unsubscribed." % presence.sender.full()
-            self._notify(content)
+            self.notifier.notify('unsubscribed', content)
 
+    @metrics.timed('molnetbot_presence_subscribe')
     def subscribeReceived(self, presence):
         """
         Subscription request was received.
 
         Always grant permission to see our presence.
 
-        """
-        self.subscribed(recipient=presence.sender,
-                        sender=presence.recipient)
-        self.available(recipient=presence.sender,
-                       status=u"Hej!",
-                       sender=presence.recipient)
-                       
-        reply = domish.Element((None, 'message'))
-        reply['to'] = presence.sender.full()
-        reply['from'] = presence.recipient.full()
-        reply['type'] = 'chat'
-        reply.addElement('body', content="Hej hej!")
-        self.send(reply)
+        The approval, our presence and a greeting are rendered from
+        templates and sent together. A server keeping our roster sends
+        our presence to the new contact itself once it has the approval,
+        so it's only sent here when connected as a component.
 
+        """
+        if not self._owns(presence.sender):
+            return
+        self._touch(presence.sender)
+        self._remember(presence)
+        to = presence.sender.full()
+        own = presence.recipient.full()
+        stanzas = [SUBSCRIBED.render(to, own)]
+        if config.COMPONENT_ENABLED:
+            stanzas.append(PRESENCE.render(to, own, u"Hej!"))
+        stanzas.append(_build_reply(to, own, u"Hej hej!"))
+        self.send(''.join(stanzas))
+
+    @metrics.timed('molnetbot_presence_unsubscribe')
     def unsubscribeReceived(self, presence):
         """
         Unsubscription request was received.
@@ -113,9 +220,14 @@ class PresenceAcceptingHandler(PresenceProtocol):
         Always confirm unsubscription requests.
 
         """
+        if not self._owns(presence.sender):
+            return
+        self._touch(presence.sender)
+        self._forget(presence)
         self.unsubscribed(recipient=presence.sender,
                           sender=presence.recipient)
 
+    @metrics.timed('molnetbot_presence_probe')
     def probeReceived(self, presence):
         """
         Presence probe was received.
@@ -125,18 +237,14 @@ class PresenceAcceptingHandler(PresenceProtocol):
         TODO: Perhaps we don't need to set status here?
 
         """
+        # Only subscribed contacts are probed for, so a probe is as good
+        # as a subscription when the server doesn't keep our roster.
+        self._touch(presence.sender)
+        self._remember(presence)
         self.available(recipient=presence.sender,
                        status=u"Queries goes here!",
                        sender=presence.recipient)
 
-    def _notify(self, content):
-        """Notify admins through xmpp."""
-
-        notification = _build_notification(content)
-        for jid in config.NOTIFY_JIDS:
-            notification['to'] = jid
-            self.send(notification)
-
 
 class QueryHandler(MessageProtocol):
     """
@@ -144,24 +252,206 @@ class QueryHandler(MessageProtocol):
     submitting their queries to the API backend and returning
     the results via xmpp messages.
 
+    Results are cached per normalized query, see L{ResultCache}, and
+    optionally kept on disk to warm the cache on restart, see
+    L{AnswerStore}. Identical queries in flight at the same time share
+    one backend request, see L{SingleFlight}. At most a fixed number of
+    backend requests run concurrently and senders are told to try again
+    when too many are waiting, see L{QueryScheduler}. Each sender is rate
+    limited before any of this happens, see L{RateLimiter}. While the
+    backend keeps failing, queries fail fast or are answered with stale
+    cached results, see L{CircuitBreaker}.
+
+    Optionally, queries are first looked up in a local copy of the
+    directory, see L{DirectorySync}, falling back to the backend when
+    no one is found.
+
+    Results are sent a page at a time. The first page goes out as soon
+    as it has arrived from the backend and the rest is kept for a while,
+    per query, for the sender to get with "more".
+
+    When running as several workers, messages from senders handled by
+    another worker are forwarded to it, see L{WorkerRouter}, and answers
+    stored on disk by any worker are reused before asking the backend.
+
+    Every chat message is recorded in the activity tracker and updates
+    the sender's last seen time in the roster, if given. Background
+    work, such as compacting the answer store and syncing the directory
+    index, is postponed while it reports heavy traffic, see
+    L{ActivityTracker}.
+
     """
-    def connectionMade(self):
+    def __init__(self, notifier, router=None, activity=None, roster=None):
+        MessageProtocol.__init__(self)
+        self.notifier = notifier
+        self.router = router
+        self.activity = activity
+        self.roster = roster
+        busy = activity.busy if activity is not None else None
+        self.ratelimiter = RateLimiter(config.RATELIMIT_RATE,
+                                       config.RATELIMIT_BURST)
+        self.cache = ResultCache(config.CACHE_TTL, config.CACHE_MAX_ENTRIES)
+        self.store = None
+        if config.CACHE_STORE_PATH:
+            self.store = AnswerStore(config.CACHE_STORE_PATH,
+                                     config.CACHE_MAX_ENTRIES, busy)
+        self.inflight = SingleFlight()
+        self.cursors = ResultCache(config.RESULTS_MORE_TIMEOUT, 10000)
+        self._waiting = {}
+        self.backend = SearchClient(config.API_SEARCH_URLS,
+                                    config.HTTP_MAX_CONNECTIONS_PER_HOST,
+                                    config.HTTP_IDLE_TIMEOUT,
+                                    config.HTTP_CONNECT_TIMEOUT,
+                                    config.HTTP_REQUEST_TIMEOUT,
+                                    hedge=config.API_HEDGE_REQUESTS)
+        self.backend.on_latency = lambda seconds: metrics.observe(
+            'molnetbot_backend_request_seconds', seconds)
+        self.scheduler = QueryScheduler(config.SCHEDULER_CONCURRENCY,
+                                        config.SCHEDULER_MAX_QUEUE)
+        self._breaker_reported = False
+        self.breaker = CircuitBreaker(config.BREAKER_FAILURE_RATIO,
+                                      config.BREAKER_MIN_CALLS,
+                                      config.BREAKER_WINDOW,
+                                      config.BREAKER_SLOW_THRESHOLD,
+                                      config.BREAKER_RESET_TIMEOUT,
+                                      on_change=self._breaker_changed)
+        self.errormail = ErrorMailer(config.SMTP_ERROR_WINDOW,
+                                     config.SMTP_MAX_CONCURRENT,
+                                     config.SMTP_RETRIES)
+        self.batcher = None
+        if config.API_BATCH_URL:
+            self.batcher = QueryBatcher(self._send_batch,
+                                        config.API_BATCH_MAX_DELAY / 1000.0,
+                                        config.API_BATCH_MAX_SIZE)
+        self.directory = None
+        if config.INDEX_ENABLED:
+            self.directory = DirectorySync(self.backend,
+                                           config.INDEX_DIRECTORY_URL,
+                                           config.INDEX_SYNC_INTERVAL,
+                                           busy)
+        self._register_metrics()
+
+    def _register_metrics(self):
+        """Expose the state of the query pipeline as metrics."""
+
+        for name in ('hits', 'misses', 'evictions', 'stale_hits'):
+            metrics.gauge('molnetbot_cache_%s_total' % name,
+                          lambda name=name: self.cache.stats[name],
+                          kind='counter')
+        metrics.gauge('molnetbot_cache_entries', lambda: len(self.cache))
+        metrics.gauge('molnetbot_coalesced_total',
+                      lambda: self.inflight.stats['coalesced'],
+                      kind='counter')
+        metrics.gauge('molnetbot_scheduler_running',
+                      lambda: self.scheduler.running)
+        metrics.gauge('molnetbot_scheduler_queued', self.scheduler.depth)
+        metrics.gauge('molnetbot_scheduler_rejected_total',
+                      lambda: self.scheduler.stats['rejected'],
+                      kind='counter')
+        metrics.gauge('molnetbot_ratelimit_throttled_total',
+                      lambda: self.ratelimiter.stats['throttled'],
+                      kind='counter')
+        metrics.gauge('molnetbot_breaker_open',
+                      lambda: self.breaker.state != 'closed')
+        metrics.gauge('molnetbot_breaker_trials_total',
+                      lambda: self.breaker.stats['trials'], kind='counter')
+        for name in ('idle', 'active', 'created'):
+            metrics.gauge('molnetbot_http_connections_%s' % name,
+                          lambda name=name: self.backend.stats()[name])
+        # Batching can be turned on and off by reloading the configuration
+        for name in ('batches', 'queries', 'missing'):
+            metrics.gauge('molnetbot_batch_%s_total' % name,
+                          lambda name=name: self.batcher.stats[name]
+                          if self.batcher is not None else 0,
+                          kind='counter')
+        metrics.gauge('molnetbot_batch_mean_size',
+                      lambda: self.batcher.mean_batch_size()
+                      if self.batcher is not None else 0)
+        metrics.gauge('molnetbot_batch_mean_wait_seconds',
+                      lambda: self.batcher.mean_wait()
+                      if self.batcher is not None else 0)
+
+    def reconfigure(self, old, new):
+        """
+        Apply reloaded settings to the query pipeline, see L{config.load}.
+
+        Limits, timeouts and backend URLs change in place, keeping cached
+        results, queued queries and latency estimates. Settings that are
+        read when used, such as the page size, need nothing done here.
+
+        """
+        self.ratelimiter.rate = new.RATELIMIT_RATE
+        self.ratelimiter.burst = float(new.RATELIMIT_BURST)
+        self.cache.ttl = new.CACHE_TTL
+        self.cache.max_entries = new.CACHE_MAX_ENTRIES
+        if self.store is not None:
+            self.store.max_entries = new.CACHE_MAX_ENTRIES
+        self.cursors.ttl = new.RESULTS_MORE_TIMEOUT
+        self.backend.set_urls(new.API_SEARCH_URLS)
+        self.backend.hedge = new.API_HEDGE_REQUESTS
+        self.backend.request_timeout = new.HTTP_REQUEST_TIMEOUT
+        self.scheduler.resize(new.SCHEDULER_CONCURRENCY,
+                              new.SCHEDULER_MAX_QUEUE)
+        self.breaker.failure_ratio = new.BREAKER_FAILURE_RATIO
+        self.breaker.min_calls = new.BREAKER_MIN_CALLS
+        self.breaker.slow_threshold = new.BREAKER_SLOW_THRESHOLD
+        self.breaker.reset_timeout = new.BREAKER_RESET_TIMEOUT
+        self.breaker.set_window(new.BREAKER_WINDOW)
+        self.errormail.window = new.SMTP_ERROR_WINDOW
+        self.errormail.retries = new.SMTP_RETRIES
+        self.errormail.scheduler.resize(new.SMTP_MAX_CONCURRENT,
+                                        self.errormail.scheduler.max_queue)
+        if not new.API_BATCH_URL:
+            if self.batcher is not None:
+                self.batcher.flush()
+            self.batcher = None
+        elif self.batcher is None:
+            self.batcher = QueryBatcher(self._send_batch,
+                                        new.API_BATCH_MAX_DELAY / 1000.0,
+                                        new.API_BATCH_MAX_SIZE)
+        else:
+            self.batcher.max_delay = new.API_BATCH_MAX_DELAY / 1000.0
+            self.batcher.max_size = new.API_BATCH_MAX_SIZE
+        if self.directory is not None and \
+                new.INDEX_SYNC_INTERVAL != old.INDEX_SYNC_INTERVAL:
+            self.directory.set_interval(new.INDEX_SYNC_INTERVAL)
+        if self.activity is not None:
+            self.activity.busy_threshold = new.BUSY_THRESHOLD
+
+    def connectionInitialized(self):
         """
         Set "away" message on connection.
+
+        Sent once the stream is initialized rather than when connected so
+        that presence goes through the outbound queue and carries the
+        avatar hash, see L{VCardTemp}.
         
         TODO: Re-read xmpp specs to see if presence _really_ needs to go out twice.
         
         """
-        self.send(AvailablePresence())
+        MessageProtocol.connectionInitialized(self)
+        # There is no roster for the server to broadcast presence to when
+        # connected as a component, see PresenceAcceptingHandler.
+        if config.COMPONENT_ENABLED:
+            return
+        priority = 0
+        if self.router is not None:
+            priority = workers.priority(self.router.index)
+        self.send(AvailablePresence(priority=priority))
         s = {'en': u"Hello!",
              'sv': u"Hej!",
              'es': u"Hola!"}
-        self.send(AvailablePresence(statuses=s))
+        self.send(AvailablePresence(statuses=s, priority=priority))
 
+    @metrics.timed('molnetbot_message')
     def onMessage(self, msg):
         """
         Handle incoming chat messages by forwarding the query to the
         backend API via HTTP.
+
+        Each line of a message is handled as a separate query. Queries
+        found in the local directory index or answered recently are
+        served without contacting the backend.
         
         Send out notifications if configured for it.
         
@@ -169,77 +459,328 @@ class QueryHandler(MessageProtocol):
         if msg.getAttribute('type') == 'chat' \
                 and hasattr(msg, 'body') \
                 and getattr(msg, 'body') != None:
-            query = msg.body
-            deferred = client.getPage(config.API_SEARCH_URL, timeout=20)
-            deferred.addCallbacks(self._answer_query,
-                                  self._query_error,
-                                  callbackArgs=(query,
-                                                msg['from'],
-                                                msg['to']),
-                                  errbackArgs=(query,
-                                               msg['from'],
-                                               msg['to']))
-            if config.NOTIFY_ON_QUERIES:
-                content = "%s sent query '%s'." % (msg['from'], query)
-                self._notify(content)
-
-    def _notify(self, content):
-        """Notify admins through xmpp."""
-
-        notification = _build_notification(content)
-        for jid in config.NOTIFY_JIDS:
-            notification['to'] = jid
-            self.send(notification)
-
-    def _answer_query(self, result, query, sender, recipient):
+            if self.router is not None and self.router.route(msg):
+                return
+            sender = jid.internJID(msg['from']).userhost()
+            if self.activity is not None:
+                self.activity.touch(sender)
+            if self.roster is not None:
+                self.roster.seen(sender)
+            if unicode(msg.body).strip().lower() == u"more":
+                if self._allow_query(msg):
+                    self._more(msg['from'], msg['to'])
+                return
+
+            # Every line of a message is a separate query and is rate
+            # limited as such. Lines beyond the sender's limit are dropped.
+            queries = [line for line in unicode(msg.body).splitlines()
+                       if line.strip()] or [unicode(msg.body)]
+            allowed = self._allow_query(msg, len(queries))
+            for query in queries[:allowed]:
+                self._handle_query(query, msg['from'], msg['to'])
+
+    def _handle_query(self, query, sender, recipient):
+        """Answer a single query locally or submit it to the backend."""
+
+        key = normalize_query(query)
+        result = self._local_search(key)
+        if result:
+            metrics.inc('molnetbot_answers_index_total')
+        else:
+            result = self.cache.get(key)
+            if result is not None:
+                metrics.inc('molnetbot_answers_cache_total')
+        if result is not None:
+            self._answer_query(result, query, sender, recipient)
+        elif self.store is not None and self.router is not None:
+            # Another worker may have asked the backend already
+            d = self.store.get(key, self.cache.ttl)
+            d.addErrback(log.err, "Failed to read shared answer")
+            d.addCallback(self._shared_answer, key, query, sender,
+                          recipient)
+        else:
+            metrics.inc('molnetbot_answers_backend_total')
+            self._submit_query(key, query, sender, recipient)
+        if config.NOTIFY_ON_QUERIES:
+            content = "%s sent query '%s'." % (sender, query)
+            self.notifier.notify('query', content, query=key)
+
+    def _shared_answer(self, stored, key, query, sender, recipient):
+        """Answer with a result stored by any worker or ask the backend."""
+
+        if stored is None:
+            metrics.inc('molnetbot_answers_backend_total')
+            self._submit_query(key, query, sender, recipient)
+            return
+        result, stored = stored
+        self.cache.put(key, result, expires=stored + self.cache.ttl)
+        metrics.inc('molnetbot_answers_shared_total')
+        self._answer_query(result, query, sender, recipient)
+
+    def _allow_query(self, msg, count=1):
+        """
+        Check the rate limit of the sender of msg for count queries.
+
+        Each query takes a token. Returns the number of queries allowed,
+        from 0 to count. Throttled senders are told so once, further
+        queries are dropped silently until they are allowed again.
+
+        """
+        sender = jid.internJID(msg['from']).userhost()
+        allowed = 0
+        status = ALLOWED
+        while allowed < count:
+            status = self.ratelimiter.consume(sender)
+            if status != ALLOWED:
+                break
+            allowed += 1
+        if status == NOTIFY:
+            self.send(_build_reply(msg['from'], msg['to'],
+                                   "You are sending queries too fast. "
+                                   "Please slow down a bit."))
+        return allowed
+
+    def _local_search(self, key):
+        """Look up key in the local directory index, if there is one."""
+
+        if self.directory is None or self.directory.index is None:
+            return None
+        return self.directory.index.search(key)
+
+    def _submit_query(self, key, query, sender, recipient):
+        """
+        Send query to the backend and reply when the result arrives.
+
+        If the same normalized query is already pending, this sender is
+        answered from that request instead of issuing a new one.
+
+        """
+        waiter = _Waiter(query, sender, recipient)
+        self._waiting.setdefault(key, []).append(waiter)
+        deferred = self.inflight.call(key, self._search, key)
+        deferred.addBoth(self._stop_waiting, key, waiter)
+        deferred.addCallbacks(self._answer_waiter,
+                              self._query_error,
+                              callbackArgs=(waiter,),
+                              errbackArgs=(query, sender, recipient))
+
+    def _stop_waiting(self, result, key, waiter):
+        waiters = self._waiting[key]
+        waiters.remove(waiter)
+        if not waiters:
+            del self._waiting[key]
+        return result
+
+    def _first_page(self, hits, key):
+        """Send the first page of hits to everyone waiting for key."""
+
+        now = time.time()
+        for waiter in self._waiting.get(key, ()):
+            if not waiter.sent:
+                self._send_hits(hits, waiter.sender, waiter.recipient)
+                waiter.sent = len(hits)
+                metrics.observe('molnetbot_first_page_seconds',
+                                now - waiter.started)
+
+    def _answer_waiter(self, result, waiter):
+        metrics.observe('molnetbot_backend_query_seconds',
+                        time.time() - waiter.started)
+        self._answer_query(result, waiter.query, waiter.sender,
+                           waiter.recipient, sent=waiter.sent)
+
+    def _search(self, key):
+        """
+        Look up a normalized query in the backend API.
+
+        Returns a deferred firing with a list of hits, which is also
+        stored in the result cache. Backend failures are reported to
+        admins by email, see L{ErrorMailer}.
+
+        With batching enabled, the query is sent along with other
+        queries arriving at about the same time, see L{QueryBatcher}.
+
+        """
+        if self.batcher is not None:
+            deferred = self.batcher.submit(key)
+        else:
+            deferred = self.scheduler.submit(
+                self.breaker.call, self.backend.search, key,
+                on_page=lambda hits: self._first_page(hits, key),
+                page_size=config.RESULTS_PAGE_SIZE)
+        deferred.addCallbacks(self._cache_result, self._backend_failed,
+                              callbackArgs=(key,), errbackArgs=(key,))
+        return deferred
+
+    def _send_batch(self, keys):
+        """
+        Look up several normalized queries in one backend request.
+
+        Returns a deferred firing with a dict from query to hits.
+
+        """
+        body = json.dumps({'queries': keys})
+        deferred = self.scheduler.submit(self.breaker.call,
+                                         self.backend.post,
+                                         config.API_BATCH_URL, body)
+        deferred.addCallback(parse_batch_results, keys)
+        return deferred
+
+    def _cache_result(self, result, key):
+        """Store a backend result in the cache and pass it on."""
+
+        self.cache.put(key, result)
+        if self.store is not None:
+            self.store.save(key, result)
+        self.errormail.succeeded()
+        return result
+
+    def warm_cache(self):
+        """
+        Fill the result cache with answers from the on-disk store.
+
+        Answers that arrived since startup are not replaced. Returns a
+        deferred.
+
+        """
+        d = self.store.load()
+        d.addCallback(self._warm_cache)
+        return d
+
+    def _warm_cache(self, answers):
+        # Most recent answers come first, put them last so that they
+        # end up as the most recently used ones.
+        for key, result, stored in reversed(answers):
+            if key not in self.cache:
+                self.cache.put(key, result, expires=stored + self.cache.ttl)
+        log.msg("Loaded %d stored answers into the cache." % len(answers))
+
+    def _backend_failed(self, error, key):
+        """Record a failed backend request and pass the failure on."""
+
+        if not error.check(QueueFull, CircuitOpen):
+            self.errormail.failed(error, key)
+        return error
+
+    def _breaker_changed(self, state):
+        """
+        Tell admins when the circuit breaker opens and when it closes
+        again. Trials in between, and the circuit opening again after a
+        failed trial, are only counted in metrics.
+
+        """
+        if state == OPEN and not self._breaker_reported:
+            self._breaker_reported = True
+        elif state == CLOSED and self._breaker_reported:
+            self._breaker_reported = False
+        else:
+            return
+        self.notifier.notify('circuit',
+                             "Circuit breaker for Molnet search is now %s."
+                             % state,
+                             urgent=True)
+
+    def _answer_query(self, result, query, sender, recipient, stale=False,
+                      sent=0):
         """
         Handle query results from backend API.
-        
-        TODO: Replace fake results with actual API results.
+
+        result is a list of hits, see L{parse_results}. Stale results are
+        served from the cache while the backend is unavailable and are
+        marked as possibly out of date.
+
+        Only the first page of hits is sent, unless sent hits have gone
+        out already. The rest is kept for the sender to ask for with
+        "more".
+
+        """
+        if not result:
+            self.send(_build_reply(sender, recipient,
+                                   u"No one found matching '%s'." % query))
+            return
+
+        page_size = config.RESULTS_PAGE_SIZE
+        if not sent:
+            note = STALE_NOTE if stale else u""
+            self._send_hits(result[:page_size], sender, recipient, note)
+            sent = page_size
+        self._keep_rest(result[sent:], query, sender, recipient)
+
+    def _keep_rest(self, hits, query, sender, recipient):
+        """
+        Keep hits not sent yet for the sender to get with "more".
+
+        Hits are kept per query, so every query of a multi-line message
+        can be continued. "more" continues the query answered last.
 
         """
-        reply = domish.Element((None, 'message'))
-        reply['to'] = sender
-        reply['from'] = recipient
-        reply['type'] = 'chat'
+        if not hits:
+            return
+        key = jid.internJID(sender).userhost()
+        pending = self.cursors.get(key) or OrderedDict()
+        pending.pop(query, None)
+        pending[query] = hits
+        self.cursors.put(key, pending)
+        self.send(_build_reply(sender, recipient,
+                               u"%d more found for '%s'. Send 'more' to "
+                               u"see them." % (len(hits), query)))
+
+    def _more(self, sender, recipient):
+        """Send the next page of hits of the last query from sender."""
+
+        key = jid.internJID(sender).userhost()
+        pending = self.cursors.get(key)
+        if not pending:
+            self.send(_build_reply(sender, recipient,
+                                   u"There is nothing more to show."))
+            return
+
+        query, hits = pending.popitem()
+        if not pending:
+            del self.cursors[key]
+        page_size = config.RESULTS_PAGE_SIZE
+        self._send_hits(hits[:page_size], sender, recipient)
+        self._keep_rest(hits[page_size:], query, sender, recipient)
+
+    def _send_hits(self, hits, sender, recipient, note=u""):
+        """Send hits as a chat message."""
+
+        started = time.time()
         # Add results as both regular text and html. It's up to the xmpp
         # client to decide which version to render.
-        reply.addElement('body', content=u"Bob Smith, Developer, (123) 456-789.")
-        html = domish.Element(('http://jabber.org/protocol/xhtml-im', 'html'))
-        html_body = domish.Element(('http://www.w3.org/1999/xhtml', 'body'))
-        html_body.addRawXml(u"<a href=\"mailto:bobsmith@example.com\">Bob Smith</a>, Developer, (123) 456-789.")
-        html.addChild(html_body)
-        reply.addChild(html)
+        reply = CHAT_HTML.render(sender, recipient,
+                                 format_text(hits) + note,
+                                 format_html(hits) + escapeToXml(note))
+        formatted = time.time()
         self.send(reply)
-
+        metrics.observe('molnetbot_format_seconds', formatted - started)
+        metrics.observe('molnetbot_send_seconds', time.time() - formatted)
 
     def _query_error(self, error, query, sender, recipient):
         """
         Handle failed API queries.
-        
-        Send out email notifications to admins.
 
-        """
-        # TODO: Move constants to external preferences
-        # Send Email on error
-        host = config.SMTP_HOST
-        from_addr = config.EMAIL_FROM
-        to_addrs = config.EMAIL_TO
+        Admins are emailed about the failure separately, so only tell
+        the sender. Queries turned away because the backend is
+        overloaded get a "busy" reply, and while the circuit breaker is
+        open a stale cached result is used if there is one.
 
-        text = "Query: '%s'." % query
-        msg = MIMEText(text.encode('utf-8'), 'plain', 'utf-8')
-        msg['Subject'] = "[Molnetbot] An error occured while sending a " \
-                         "search query to Molnet."
-        msg['From'] = from_addr
-        msg['To'] = ', '.join(to_addrs)
-        deferred = sendmail(host, from_addr, to_addrs, msg.as_string())
+        """
+        metrics.inc('molnetbot_query_errors_total')
+        if error.check(CircuitOpen):
+            result = self.cache.get_stale(normalize_query(query))
+            if result is not None:
+                self._answer_query(result, query, sender, recipient,
+                                   stale=True)
+                return
+
+        if error.check(QueueFull):
+            self.send(_build_reply(sender, recipient,
+                                   "Molnet is busy right now. Please try "
+                                   "again in a moment."))
+            return
 
         # Send error reply back to query sender
-        reply = domish.Element((None, 'message'))
-        reply['to'] = sender
-        reply['from'] = recipient
-        reply['type'] = 'chat'
-        reply.addElement('body', content="An error occurred while "
-                                         "sending your search query to "
-                                         "Molnet. Please try again later.")
-        self.send(reply)
+        self.send(_build_reply(sender, recipient,
+                               "An error occurred while sending your "
+                               "search query to Molnet. Please try again "
+                               "later."))
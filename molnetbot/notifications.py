@@ -0,0 +1,134 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+The MIT license
+
+Copyright (c) 2010 Jonas Nockert
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+---
+
+
+Admin notifications over xmpp.
+
+Events are collected and sent out as one digest per admin at regular
+intervals rather than one message per event.
+
+"""
+from collections import Counter
+
+import config
+from stanzas import CHAT
+
+
+def build_notification(to, sender, content):
+    """Builds a serialized xmpp notification for sending out to admins."""
+
+    # type 'headline' is more appropriate really but headlines
+    # are often displayed in a dialog so that's not cool
+    return CHAT.render(to, sender, content)
+
+
+class NotificationDigest(object):
+    """
+    Buffers admin notifications and flushes them as a digest.
+
+    A digest is sent C{interval} seconds after the first buffered event
+    or as soon as C{max_events} events are buffered, whichever comes
+    first. It holds counts per event type, the C{top} most frequent
+    queries and the text of other events. Urgent events are sent right
+    away. An interval of 0 disables batching altogether.
+
+    Notifications are sent from C{sender}, which must be the component's
+    JID when connected as a component.
+
+    """
+    def __init__(self, send, sender, interval, max_events, top=5,
+                 clock=None):
+        if clock is None:
+            from twisted.internet import reactor
+            clock = reactor
+        self.send = send
+        self.sender = sender
+        self.interval = interval
+        self.max_events = max_events
+        self.top = top
+        self.clock = clock
+        self._call = None
+        self._reset()
+
+    def _reset(self):
+        self._pending = 0
+        self._counts = Counter()
+        self._queries = Counter()
+        self._events = []
+
+    def notify(self, kind, content, query=None, urgent=False):
+        """
+        Add an event of type kind to the digest.
+
+        Events with a query are summarized by query, other events are
+        listed with their content.
+
+        """
+        if urgent or self.interval <= 0:
+            self._send_all(content)
+            return
+
+        self._pending += 1
+        self._counts[kind] += 1
+        if query is not None:
+            self._queries[query] += 1
+        else:
+            self._events.append(content)
+
+        if self._pending >= self.max_events:
+            self.flush()
+        elif self._call is None:
+            self._call = self.clock.callLater(self.interval, self.flush)
+
+    def flush(self):
+        """Send out buffered events now, if there are any."""
+
+        if self._call is not None:
+            if self._call.active():
+                self._call.cancel()
+            self._call = None
+
+        if not self._pending:
+            return
+
+        content = self._format()
+        self._reset()
+        self._send_all(content)
+
+    def _format(self):
+        lines = ["%d events:" % self._pending]
+        for kind, count in sorted(self._counts.iteritems()):
+            lines.append("  %s: %d" % (kind, count))
+        if self._queries:
+            lines.append("Top queries:")
+            for query, count in self._queries.most_common(self.top):
+                lines.append(u"  %s (%d)" % (query, count))
+        lines.extend(self._events)
+        return u"\n".join(lines)
+
+    def _send_all(self, content):
+        for jid in config.NOTIFY_JIDS:
+            self.send(build_notification(jid, self.sender, content))
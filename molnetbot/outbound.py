@@ -0,0 +1,160 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+The MIT license
+
+Copyright (c) 2010 Jonas Nockert
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+---
+
+
+Coalescing outbound stanza queue.
+
+"""
+from twisted.internet.interfaces import IPushProducer
+from twisted.words.xish import domish
+from wokkel.subprotocols import XMPPHandler
+from zope.interface import implementer
+
+
+@implementer(IPushProducer)
+class OutboundQueue(XMPPHandler):
+    """
+    Collects stanzas sent during one reactor turn into a single write.
+
+    Once the stream is initialized, everything sent on it by any handler
+    is serialized and queued, and the queue is written to the transport
+    in one go at the end of the current reactor turn.
+
+    The queue registers as a producer with the transport. While the
+    transport's own buffer is full, queued stanzas are held back. When
+    more than C{high_water} bytes are held back, we stop reading from
+    the connection so that no new queries come in until the queue
+    drains below C{low_water} bytes.
+
+    Should be the first handler added to the stream manager so that its
+    connectionInitialized runs before other handlers start sending.
+
+    External components must set the from attribute on everything they
+    send. If C{sender} is given, it's used for stanzas that have none.
+
+    """
+    def __init__(self, high_water=256 * 1024, low_water=64 * 1024,
+                 sender=None, clock=None):
+        XMPPHandler.__init__(self)
+        if clock is None:
+            from twisted.internet import reactor
+            clock = reactor
+        self.high_water = high_water
+        self.low_water = low_water
+        self.sender = sender
+        self.clock = clock
+        self._queue = []
+        self._size = 0
+        self._call = None
+        self._paused = False
+        self._reading_paused = False
+        self.stats = {'flushes': 0,
+                      'stanzas': 0,
+                      'bytes': 0,
+                      'max_flush': 0,
+                      'pauses': 0}
+
+    def depth(self):
+        """Number of queued stanzas and their size in bytes."""
+
+        return len(self._queue), self._size
+
+    def connectionInitialized(self):
+        self.xmlstream.send = self.enqueue
+        self.xmlstream.transport.registerProducer(self, True)
+
+    def connectionLost(self, reason):
+        if self._call is not None and self._call.active():
+            self._call.cancel()
+        self._call = None
+        self._queue = []
+        self._size = 0
+        self._paused = False
+        self._reading_paused = False
+
+    def enqueue(self, obj):
+        """Serialize obj and queue it for writing. Replaces xs.send."""
+
+        xs = self.xmlstream
+        if domish.IElement.providedBy(obj):
+            if self.sender is not None and not obj.getAttribute('from'):
+                obj['from'] = self.sender
+            obj = obj.toXml(prefixes=xs.prefixes,
+                            defaultUri=xs.namespace,
+                            prefixesInScope=list(xs.prefixes.values()))
+        if isinstance(obj, unicode):
+            obj = obj.encode('utf-8')
+
+        self._queue.append(obj)
+        self._size += len(obj)
+        if self._paused:
+            if self._size > self.high_water and not self._reading_paused:
+                self._reading_paused = True
+                xs.transport.pauseProducing()
+        elif self._call is None:
+            self._call = self.clock.callLater(0, self.flush)
+
+    def flush(self):
+        """Write all queued stanzas to the transport."""
+
+        if self._call is not None and self._call.active():
+            self._call.cancel()
+        self._call = None
+        if not self._queue:
+            return
+
+        data = ''.join(self._queue)
+        count = len(self._queue)
+        self._queue = []
+        self._size = 0
+
+        self.stats['flushes'] += 1
+        self.stats['stanzas'] += count
+        self.stats['bytes'] += len(data)
+        self.stats['max_flush'] = max(self.stats['max_flush'], count)
+
+        xs = self.xmlstream
+        if xs.rawDataOutFn:
+            xs.rawDataOutFn(data)
+        xs.transport.write(data)
+
+    def pauseProducing(self):
+        """The transport buffer is full, hold stanzas back."""
+
+        self._paused = True
+        self.stats['pauses'] += 1
+
+    def resumeProducing(self):
+        """The transport buffer has drained, write what's queued."""
+
+        self._paused = False
+        self.flush()
+        if self._reading_paused and self._size <= self.low_water:
+            self._reading_paused = False
+            self.xmlstream.transport.resumeProducing()
+
+    def stopProducing(self):
+        pass
@@ -0,0 +1,213 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+The MIT license
+
+Copyright (c) 2010 Jonas Nockert
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+---
+
+
+On-demand profiling, reactor lag monitoring and startup timing.
+
+"""
+import cProfile
+import os
+import sys
+import thread
+import threading
+import time
+import traceback
+
+from twisted.internet import defer, task
+from twisted.python import log
+from wokkel.subprotocols import XMPPHandler
+
+import metrics
+
+_imported = time.time()
+
+
+def process_started():
+    """
+    Time this process was started, read from /proc on Linux.
+
+    Elsewhere, the time this module was imported is close enough.
+
+    """
+    try:
+        with open('/proc/self/stat') as f:
+            # Fields after the command name, which may contain spaces,
+            # starting from field 3. Field 22 is the start time in clock
+            # ticks after boot.
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        ticks = os.sysconf('SC_CLK_TCK')
+        return time.time() - uptime + float(fields[19]) / ticks
+    except (IOError, OSError, ValueError, IndexError):
+        return _imported
+
+
+class Profiler(object):
+    """
+    Runs cProfile sessions inside the running process.
+
+    Stats are written in the pstats format, which can be read with the
+    pstats module or turned into flame graphs with tools such as
+    flameprof or snakeviz.
+
+    """
+    max_seconds = 300
+
+    def __init__(self, directory, clock=None):
+        if clock is None:
+            from twisted.internet import reactor
+            clock = reactor
+        self.directory = directory
+        self.clock = clock
+        self._profile = None
+
+    def run(self, seconds):
+        """
+        Profile for the given number of seconds.
+
+        Returns a deferred firing with the path of the stats file.
+
+        """
+        if self._profile is not None:
+            return defer.fail(RuntimeError("A profiling session is "
+                                           "already running."))
+        seconds = min(max(seconds, 1), self.max_seconds)
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+        return task.deferLater(self.clock, seconds, self._stop)
+
+    def _stop(self):
+        profile, self._profile = self._profile, None
+        profile.disable()
+        path = os.path.join(self.directory, "molnetbot-%s.pstats" %
+                            time.strftime("%Y%m%d-%H%M%S"))
+        profile.dump_stats(path)
+        log.msg("Profile written to %s" % path)
+        return path
+
+    def command(self, sender, args):
+        """
+        Ad-hoc command starting a profiling session.
+
+        Answers right away, the stats file is written to the profile
+        directory when the session ends.
+
+        """
+        try:
+            seconds = int(args or 30)
+        except ValueError:
+            return "Usage: number of seconds to profile."
+        if self._profile is not None:
+            return "A profiling session is already running."
+        seconds = min(max(seconds, 1), self.max_seconds)
+        d = self.run(seconds)
+        d.addErrback(log.err, "Profiling failed")
+        return "Profiling for %d s, output in %s" % (seconds, self.directory)
+
+
+class LagMonitor(object):
+    """
+    Measures how late the reactor runs scheduled calls.
+
+    A heartbeat is scheduled every C{interval} seconds and its lateness
+    recorded as reactor lag. A watchdog thread checks the heartbeat and
+    when the reactor has been stuck for more than C{threshold} seconds
+    it logs the stack of the reactor thread, pointing out the blocking
+    callback while it is still running.
+
+    """
+    def __init__(self, interval=0.1, threshold=0.5, clock=None):
+        if clock is None:
+            from twisted.internet import reactor
+            clock = reactor
+        self.interval = interval
+        self.threshold = threshold
+        self.clock = clock
+        self._loop = task.LoopingCall(self._beat)
+        self._loop.clock = clock
+        self._last = None
+        self._stop = threading.Event()
+        self._reactor_thread = None
+
+    def start(self):
+        self._reactor_thread = thread.get_ident()
+        self._last = time.time()
+        self._loop.start(self.interval, now=False)
+        watchdog = threading.Thread(target=self._watch,
+                                    name="molnetbot-lag-watchdog")
+        watchdog.daemon = True
+        watchdog.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._loop.running:
+            self._loop.stop()
+
+    def _beat(self):
+        now = time.time()
+        lag = max(0.0, now - self._last - self.interval)
+        self._last = now
+        metrics.observe('molnetbot_reactor_lag_seconds', lag)
+        if lag > self.threshold:
+            metrics.inc('molnetbot_reactor_stalls_total')
+
+    def _watch(self):
+        reported = None
+        while not self._stop.wait(self.threshold / 2):
+            last = self._last
+            stuck = time.time() - last - self.interval
+            if stuck > self.threshold and reported != last:
+                reported = last
+                frame = sys._current_frames().get(self._reactor_thread)
+                if frame is not None:
+                    stack = ''.join(traceback.format_stack(frame))
+                    log.msg("Reactor blocked for %.2f s in:\n%s" %
+                            (stuck, stack))
+
+
+class StartupTimer(XMPPHandler):
+    """
+    Measures the time from starting the process until the first stream is
+    initialized and the bot is ready to answer.
+
+    The time is logged and exposed as metric molnetbot_startup_seconds.
+    Add it after all other handlers, so that it's initialized last.
+
+    """
+    def __init__(self, started=None):
+        XMPPHandler.__init__(self)
+        if started is None:
+            started = process_started()
+        self.started = started
+        self.seconds = None
+
+    def connectionInitialized(self):
+        if self.seconds is not None:
+            return
+        self.seconds = time.time() - self.started
+        metrics.gauge('molnetbot_startup_seconds', lambda: self.seconds)
+        log.msg("Ready to answer %.2f s after start." % self.seconds)
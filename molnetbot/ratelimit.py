@@ -0,0 +1,116 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+The MIT license
+
+Copyright (c) 2010 Jonas Nockert
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+---
+
+
+Per-sender token bucket rate limiting.
+
+"""
+
+# Results of RateLimiter.consume()
+ALLOWED = 0
+THROTTLED = 1
+NOTIFY = 2
+
+
+class _Bucket(object):
+    __slots__ = ('tokens', 'stamp', 'notified')
+
+    def __init__(self, tokens, stamp):
+        self.tokens = tokens
+        self.stamp = stamp
+        self.notified = False
+
+
+class RateLimiter(object):
+    """
+    Token buckets keyed on sender.
+
+    Every sender may send C{burst} queries at once, refilled at C{rate}
+    queries per second. Buckets that have refilled completely carry no
+    information and are swept every C{sweep_interval} seconds, so memory
+    only grows with the number of recently active senders.
+
+    """
+    def __init__(self, rate, burst, sweep_interval=60, clock=None):
+        if clock is None:
+            from twisted.internet import reactor
+            clock = reactor
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.sweep_interval = sweep_interval
+        self.clock = clock
+        self._buckets = {}
+        self._next_sweep = clock.seconds() + sweep_interval
+        self.stats = {'allowed': 0,
+                      'throttled': 0}
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def consume(self, key):
+        """
+        Take a token from the bucket of key.
+
+        Returns L{ALLOWED} if there was one. Otherwise returns L{NOTIFY}
+        the first time a sender is throttled and L{THROTTLED} for
+        following messages until a token is available again.
+
+        """
+        now = self.clock.seconds()
+        if now >= self._next_sweep:
+            self.sweep(now)
+
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _Bucket(self.burst, now)
+        else:
+            bucket.tokens = min(self.burst, bucket.tokens +
+                                (now - bucket.stamp) * self.rate)
+            bucket.stamp = now
+
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            bucket.notified = False
+            self.stats['allowed'] += 1
+            return ALLOWED
+
+        self.stats['throttled'] += 1
+        if bucket.notified:
+            return THROTTLED
+        bucket.notified = True
+        return NOTIFY
+
+    def sweep(self, now=None):
+        """Forget buckets that would be full by now."""
+
+        if now is None:
+            now = self.clock.seconds()
+        full = [key for key, bucket in self._buckets.iteritems()
+                if bucket.tokens + (now - bucket.stamp) * self.rate
+                   >= self.burst]
+        for key in full:
+            del self._buckets[key]
+        self._next_sweep = now + self.sweep_interval
@@ -0,0 +1,76 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+The MIT license
+
+Copyright (c) 2010 Jonas Nockert
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+---
+
+
+Bakes the version, the latest git tag, into molnetbot/_version.py.
+
+Run by buildout, see buildout.cfg, or by hand from a git checkout after
+tagging:
+
+$ python molnetbot/release.py
+
+Outside a git checkout an existing _version.py is left alone, so that a
+released tree keeps its version.
+
+"""
+import os
+import subprocess
+import sys
+
+
+TARGET = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      '_version.py')
+
+
+def describe():
+    """Return the output of git describe, or None if it failed."""
+
+    try:
+        p = subprocess.Popen(['git', 'describe', '--tags', '--always'],
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                             cwd=os.path.dirname(TARGET))
+    except OSError:
+        return None
+    out = p.communicate()[0]
+    if p.returncode != 0:
+        return None
+    return out.strip()
+
+
+def main():
+    version = describe()
+    if version is None:
+        if os.path.exists(TARGET):
+            return
+        version = "na"
+    with open(TARGET, 'w') as f:
+        f.write("# Written by release.py at build time, don't edit.\n"
+                "VERSION = %r\n" % version)
+    sys.stdout.write("molnetbot version %s\n" % version)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+The MIT license
+
+Copyright (c) 2010 Jonas Nockert
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+---
+
+
+Parsing and formatting of search results.
+
+The search API answers with a JSON list of people, each an object with
+'name', 'title', 'phone' and 'email' members (any of which may be
+missing), optionally wrapped in an object as {"results": [...]}. The batch
+endpoint takes {"queries": [...]} posted as JSON.
+
+"""
+import json
+
+from twisted.words.xish.domish import escapeToXml
+
+
+def parse_results(body):
+    """Parse a search API response body into a list of hits."""
+
+    data = json.loads(body)
+    if isinstance(data, dict):
+        data = data.get('results', [])
+    return data
+
+
+def parse_batch_results(body, queries):
+    """
+    Parse a batch API response body.
+
+    The batch endpoint answers with a JSON list holding one list of hits
+    per query, in the order the queries were sent. Returns a dict from
+    query to hits, leaving out queries the response holds no list for.
+
+    """
+    return dict((query, hits)
+                for query, hits in zip(queries, json.loads(body))
+                if isinstance(hits, list))
+
+
+def _fields(hit):
+    return [unicode(hit[field]) for field in ('title', 'phone')
+            if hit.get(field)]
+
+
+def format_text(hits):
+    """Format hits as plain text, one hit per line."""
+
+    lines = []
+    for hit in hits:
+        lines.append(u", ".join([hit.get('name', u"?")] + _fields(hit)))
+    return u"\n".join(lines)
+
+
+def format_html(hits):
+    """Format hits as XHTML-IM body content with mailto links."""
+
+    lines = []
+    for hit in hits:
+        name = escapeToXml(hit.get('name', u"?"))
+        if hit.get('email'):
+            name = u"<a href=\"mailto:%s\">%s</a>" % (
+                       escapeToXml(hit['email'], isattrib=1), name)
+        lines.append(u", ".join([name] +
+                                [escapeToXml(f) for f in _fields(hit)]))
+    return u"<br/>".join(lines)
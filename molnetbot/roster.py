@@ -0,0 +1,220 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+The MIT license
+
+Copyright (c) 2010 Jonas Nockert
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+---
+
+
+Persistent roster of subscribed contacts.
+
+Contacts are kept in an SQLite database, like answers in L{AnswerStore},
+so that the bot knows who to send presence to after a restart when the
+server keeps no roster for it. Changes are collected in memory and
+written together, in a thread, off the reactor.
+
+"""
+from twisted.enterprise import adbapi
+from twisted.internet import defer, task
+from twisted.python import log
+
+
+class RosterStore(object):
+    """
+    Contacts by bare JID, with the JID of ours they subscribed to and the
+    time they were last seen.
+
+    C{contacts} maps contacts to [own JID, last seen] lists. It's filled
+    in from the database in the background, see L{when_loaded}. Without a
+    path, contacts are only kept in memory.
+
+    Changes are written in one transaction C{flush_interval} seconds after
+    the first of them, so a contact changed several times in between is
+    written once. Last seen times are only updated when they are more
+    than C{seen_resolution} seconds old.
+
+    """
+    def __init__(self, path=None, flush_interval=5, seen_resolution=60,
+                 clock=None):
+        if clock is None:
+            from twisted.internet import reactor
+            clock = reactor
+        self.flush_interval = flush_interval
+        self.seen_resolution = seen_resolution
+        self.clock = clock
+        self.contacts = {}
+        self.stats = {'flushes': 0,
+                      'writes': 0}
+        self._dirty = {}
+        self._call = None
+        self._waiting = []
+        self.dbpool = None
+        if path:
+            self.dbpool = adbapi.ConnectionPool('sqlite3', path,
+                                                check_same_thread=False,
+                                                cp_min=1, cp_max=1)
+            d = self.dbpool.runOperation(
+                "CREATE TABLE IF NOT EXISTS contacts "
+                "(contact TEXT PRIMARY KEY, own TEXT, last_seen REAL)")
+            d.addCallback(lambda _: self.dbpool.runQuery(
+                "SELECT contact, own, last_seen FROM contacts"))
+            d.addCallbacks(self._loaded, self._load_failed)
+        else:
+            self._loaded([])
+
+    def __len__(self):
+        return len(self.contacts)
+
+    def _loaded(self, rows):
+        for contact, own, last_seen in rows:
+            # Changes made while loading are more recent
+            if contact not in self._dirty:
+                self.contacts[contact] = [own, last_seen]
+        waiting, self._waiting = self._waiting, None
+        for d in waiting:
+            d.callback(self.contacts)
+
+    def _load_failed(self, error):
+        log.err(error, "Failed to load roster")
+        self._loaded([])
+
+    def when_loaded(self):
+        """Return a deferred firing with C{contacts} once loaded."""
+
+        if self._waiting is None:
+            return defer.succeed(self.contacts)
+        d = defer.Deferred()
+        self._waiting.append(d)
+        return d
+
+    def add(self, contact, own):
+        """Record that contact subscribed to own, or was seen again."""
+
+        now = self.clock.seconds()
+        entry = self.contacts.get(contact)
+        if entry is not None and entry[0] == own and \
+                now - entry[1] < self.seen_resolution:
+            return
+        self.contacts[contact] = [own, now]
+        self._changed(contact, (own, now))
+
+    def seen(self, contact):
+        """Update the last seen time of contact, if subscribed."""
+
+        entry = self.contacts.get(contact)
+        if entry is None:
+            return
+        now = self.clock.seconds()
+        if now - entry[1] < self.seen_resolution:
+            return
+        entry[1] = now
+        self._changed(contact, tuple(entry))
+
+    def remove(self, contact):
+        """Forget contact."""
+
+        self.contacts.pop(contact, None)
+        self._changed(contact, None)
+
+    def _changed(self, contact, entry):
+        if self.dbpool is None:
+            return
+        self._dirty[contact] = entry
+        if self._call is None:
+            self._call = self.clock.callLater(self.flush_interval,
+                                              self.flush)
+
+    def flush(self):
+        """Write pending changes now. Returns a deferred."""
+
+        if self._call is not None and self._call.active():
+            self._call.cancel()
+        self._call = None
+        if not self._dirty:
+            return defer.succeed(None)
+
+        dirty, self._dirty = self._dirty, {}
+        self.stats['flushes'] += 1
+        self.stats['writes'] += len(dirty)
+        d = self.dbpool.runInteraction(self._write, dirty)
+        d.addErrback(log.err, "Failed to write roster")
+        return d
+
+    def _write(self, cursor, dirty):
+        cursor.executemany(
+            "INSERT OR REPLACE INTO contacts VALUES (?, ?, ?)",
+            [(contact, entry[0], entry[1])
+             for contact, entry in dirty.iteritems() if entry is not None])
+        cursor.executemany(
+            "DELETE FROM contacts WHERE contact = ?",
+            [(contact,) for contact, entry in dirty.iteritems()
+             if entry is None])
+
+
+class PacedBroadcast(object):
+    """
+    Sends serialized stanzas C{batch_size} at a time, at most C{rate}
+    stanzas per second on average.
+
+    Servers throttle or disconnect senders going over their traffic
+    limits, so presence for a large roster is spread out rather than
+    sent all at once. Each batch is passed to C{send} as one string and
+    goes out in a single write. Raises ValueError unless rate is positive
+    and batches hold at least one stanza.
+
+    """
+    def __init__(self, stanzas, send, rate, batch_size, clock=None):
+        if rate <= 0 or batch_size < 1:
+            raise ValueError("Need a positive rate and batch size, got "
+                             "%r and %r." % (rate, batch_size))
+        if clock is None:
+            from twisted.internet import reactor
+            clock = reactor
+        self.stanzas = stanzas
+        self.send = send
+        self.batch_size = batch_size
+        self.sent = 0
+        self._loop = task.LoopingCall(self._send_batch)
+        self._loop.clock = clock
+        self._interval = float(self.batch_size) / rate
+
+    def start(self):
+        """
+        Start sending. Returns a deferred firing with the number of
+        stanzas sent when done or stopped.
+
+        """
+        d = self._loop.start(self._interval)
+        d.addCallback(lambda _: self.sent)
+        return d
+
+    def stop(self):
+        if self._loop.running:
+            self._loop.stop()
+
+    def _send_batch(self):
+        batch = self.stanzas[self.sent:self.sent + self.batch_size]
+        if batch:
+            self.send(''.join(batch))
+            self.sent += len(batch)
+        if self.sent >= len(self.stanzas):
+            self.stop()
@@ -0,0 +1,123 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+The MIT license
+
+Copyright (c) 2010 Jonas Nockert
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+---
+
+
+Bounded-concurrency scheduling of backend requests.
+
+"""
+from collections import deque
+
+from twisted.internet import defer
+
+
+class QueueFull(Exception):
+    """Raised when a request is rejected because the wait queue is full."""
+
+
+class QueryScheduler(object):
+    """
+    Runs at most C{concurrency} calls at a time.
+
+    Calls beyond that wait in a FIFO queue of at most C{max_queue}
+    entries. Once the queue is full, new calls fail immediately with
+    L{QueueFull} instead of piling up.
+
+    """
+    def __init__(self, concurrency, max_queue):
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.running = 0
+        self._queue = deque()
+        self._draining = False
+        self.stats = {'started': 0,
+                      'queued': 0,
+                      'rejected': 0}
+
+    def depth(self):
+        """Number of calls waiting to be started."""
+
+        return len(self._queue)
+
+    def submit(self, f, *args, **kwargs):
+        """
+        Schedule f(*args, **kwargs).
+
+        Returns a deferred firing with the result of the call, or failing
+        with L{QueueFull} right away if the call can't be queued.
+
+        """
+        if self.running < self.concurrency:
+            return self._start(f, args, kwargs)
+
+        if len(self._queue) >= self.max_queue:
+            self.stats['rejected'] += 1
+            return defer.fail(QueueFull())
+
+        d = defer.Deferred()
+        self._queue.append((d, f, args, kwargs))
+        self.stats['queued'] += 1
+        return d
+
+    def resize(self, concurrency, max_queue):
+        """Change the limits, starting queued calls that now fit."""
+
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self._drain()
+
+    def _start(self, f, args, kwargs):
+        self.running += 1
+        self.stats['started'] += 1
+        d = defer.maybeDeferred(f, *args, **kwargs)
+        d.addBoth(self._finished)
+        return d
+
+    def _finished(self, result):
+        """Start the next queued call, if any, and pass result on."""
+
+        self.running -= 1
+        self._drain()
+        return result
+
+    def _drain(self):
+        """
+        Start queued calls while there is room.
+
+        Calls that finish right away, such as calls rejected by an open
+        circuit breaker, end up back here. They return at once and the
+        outer call carries on in its loop, so a long queue doesn't use
+        up the stack.
+
+        """
+        if self._draining:
+            return
+        self._draining = True
+        try:
+            while self._queue and self.running < self.concurrency:
+                waiting, f, args, kwargs = self._queue.popleft()
+                self._start(f, args, kwargs).chainDeferred(waiting)
+        finally:
+            self._draining = False
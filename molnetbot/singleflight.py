@@ -0,0 +1,79 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+The MIT license
+
+Copyright (c) 2010 Jonas Nockert
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+---
+
+
+Coalescing of identical in-flight requests.
+
+"""
+from twisted.internet import defer
+from twisted.python import failure
+
+
+class SingleFlight(object):
+    """
+    Makes sure only one call per key is in flight at any time.
+
+    The first caller for a key starts the actual call. Callers arriving
+    while it is still pending get their own deferred which fires with the
+    same result (or failure) once the call completes.
+
+    """
+    def __init__(self):
+        self._waiters = {}
+        self.stats = {'calls': 0,
+                      'coalesced': 0}
+
+    def __contains__(self, key):
+        return key in self._waiters
+
+    def call(self, key, f, *args, **kwargs):
+        """
+        Call f(*args, **kwargs) unless a call for key is already pending.
+
+        Returns a deferred that fires with the result of the shared call.
+
+        """
+        d = defer.Deferred()
+        if key in self._waiters:
+            self._waiters[key].append(d)
+            self.stats['coalesced'] += 1
+            return d
+
+        self._waiters[key] = [d]
+        self.stats['calls'] += 1
+        result = defer.maybeDeferred(f, *args, **kwargs)
+        result.addBoth(self._release, key)
+        return d
+
+    def _release(self, result, key):
+        """Fire every deferred waiting on key with result."""
+
+        waiters = self._waiters.pop(key)
+        for d in waiters:
+            if isinstance(result, failure.Failure):
+                d.errback(result)
+            else:
+                d.callback(result)
@@ -0,0 +1,97 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+The MIT license
+
+Copyright (c) 2010 Jonas Nockert
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+---
+
+
+Precompiled stanza templates.
+
+The constant parts of the stanzas we send most are serialized once.
+Rendering a stanza only escapes and encodes the per-message values, and
+the result is UTF-8 encoded bytes ready to be written to the xmlstream.
+
+"""
+from twisted.words.xish.domish import escapeToXml
+
+
+# Ways of filling in a template slot
+ATTRIBUTE = 'attribute'
+TEXT = 'text'
+RAW = 'raw'
+
+
+class StanzaTemplate(object):
+    """
+    A serialized stanza with %s slots for per-message values.
+
+    C{slots} holds, for each slot, whether its value is an attribute
+    value or character data to be escaped, or markup inserted as is.
+
+    """
+    def __init__(self, xml, slots):
+        self.xml = xml.encode('utf-8')
+        self.slots = tuple(slots)
+
+    def render(self, *values):
+        """Fill in values and return the stanza as UTF-8 bytes."""
+
+        encoded = []
+        for kind, value in zip(self.slots, values):
+            if kind == ATTRIBUTE:
+                value = escapeToXml(value, isattrib=1)
+            elif kind == TEXT:
+                value = escapeToXml(value)
+            if isinstance(value, unicode):
+                value = value.encode('utf-8')
+            encoded.append(value)
+        return self.xml % tuple(encoded)
+
+
+# Plain chat message: to, from, body
+CHAT = StanzaTemplate(
+    u'<message to="%s" from="%s" type="chat"><body>%s</body></message>',
+    (ATTRIBUTE, ATTRIBUTE, TEXT))
+
+# Chat message with an XHTML-IM alternative: to, from, body, XHTML markup
+CHAT_HTML = StanzaTemplate(
+    u'<message to="%s" from="%s" type="chat"><body>%s</body>'
+    u'<html xmlns="http://jabber.org/protocol/xhtml-im">'
+    u'<body xmlns="http://www.w3.org/1999/xhtml">%s</body>'
+    u'</html></message>',
+    (ATTRIBUTE, ATTRIBUTE, TEXT, RAW))
+
+# IQ result: to, from, id, payload markup
+IQ_RESULT = StanzaTemplate(
+    u'<iq type="result" to="%s" from="%s" id="%s">%s</iq>',
+    (ATTRIBUTE, ATTRIBUTE, ATTRIBUTE, RAW))
+
+# Directed available presence: to, from, status
+PRESENCE = StanzaTemplate(
+    u'<presence to="%s" from="%s"><status>%s</status></presence>',
+    (ATTRIBUTE, ATTRIBUTE, TEXT))
+
+# Subscription approval: to, from
+SUBSCRIBED = StanzaTemplate(
+    u'<presence to="%s" from="%s" type="subscribed"/>',
+    (ATTRIBUTE, ATTRIBUTE))
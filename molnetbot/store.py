@@ -0,0 +1,120 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+The MIT license
+
+Copyright (c) 2010 Jonas Nockert
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+---
+
+
+Persistent on-disk store of recent answers.
+
+Answers are kept in an SQLite database so that a restarted bot can warm
+its result cache instead of sending all traffic to the backend. All
+database access runs in a thread, off the reactor.
+
+"""
+import json
+import time
+
+from twisted.enterprise import adbapi
+from twisted.python import log
+
+
+class AnswerStore(object):
+    """
+    SQLite backed store of query -> result pairs.
+
+    At most C{max_entries} answers are kept. Older answers are removed
+    every C{max_entries} writes, or later if C{busy} returns true then.
+
+    """
+    def __init__(self, path, max_entries, busy=None):
+        self.max_entries = max_entries
+        self.busy = busy
+        self.dbpool = adbapi.ConnectionPool('sqlite3', path,
+                                            check_same_thread=False,
+                                            cp_min=1, cp_max=1)
+        self._writes = 0
+        self._ready = self.dbpool.runOperation(
+            "CREATE TABLE IF NOT EXISTS answers "
+            "(key TEXT PRIMARY KEY, result TEXT, stored REAL)")
+        self._ready.addErrback(log.err, "Failed to create answer store")
+
+    def save(self, key, result):
+        """Store result for key in the background."""
+
+        d = self.dbpool.runOperation(
+            "INSERT OR REPLACE INTO answers VALUES (?, ?, ?)",
+            (key, json.dumps(result), time.time()))
+        d.addErrback(log.err, "Failed to store answer")
+
+        self._writes += 1
+        if self._writes >= self.max_entries and \
+                (self.busy is None or not self.busy()):
+            self._writes = 0
+            self.compact()
+
+    def get(self, key, max_age):
+        """
+        Look up the answer for key stored less than max_age seconds ago.
+
+        Several workers can share one store. Returns a deferred firing
+        with a (result, stored) tuple, or None if there is no such
+        answer.
+
+        """
+        return self.dbpool.runInteraction(self._get, key,
+                                          time.time() - max_age)
+
+    def _get(self, cursor, key, since):
+        cursor.execute("SELECT result, stored FROM answers "
+                       "WHERE key = ? AND stored > ?", (key, since))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def load(self):
+        """
+        Read stored answers, most recent first.
+
+        Returns a deferred firing with a list of (key, result, stored)
+        tuples.
+
+        """
+        return self.dbpool.runInteraction(self._load)
+
+    def _load(self, cursor):
+        cursor.execute("SELECT key, result, stored FROM answers "
+                       "ORDER BY stored DESC LIMIT ?", (self.max_entries,))
+        return [(key, json.loads(result), stored)
+                for key, result, stored in cursor.fetchall()]
+
+    def compact(self):
+        """Drop all but the most recent answers."""
+
+        d = self.dbpool.runOperation(
+            "DELETE FROM answers WHERE key NOT IN "
+            "(SELECT key FROM answers ORDER BY stored DESC LIMIT ?)",
+            (self.max_entries,))
+        d.addErrback(log.err, "Failed to compact answer store")
+        return d
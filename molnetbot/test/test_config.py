@@ -0,0 +1,93 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+The MIT license
+
+Copyright (c) 2010 Jonas Nockert
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+---
+
+
+Tests for molnetbot.config.
+
+"""
+import os
+import re
+import shutil
+
+from twisted.trial import unittest
+
+from molnetbot import config
+
+
+SAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      '..', '..', 'molnetbot.conf.sample')
+
+
+class ReloadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = self.mktemp()
+        shutil.copy(SAMPLE, self.path)
+        self.addCleanup(setattr, config, 'settings', config.settings)
+        self.addCleanup(setattr, config, '_listeners', config._listeners)
+        config.settings = None
+        config._listeners = []
+        config.load(self.path)
+
+    def edit(self, pattern, replacement):
+        with open(self.path) as f:
+            text = f.read()
+        with open(self.path, 'w') as f:
+            f.write(re.sub(pattern, replacement, text, count=1,
+                           flags=re.MULTILINE))
+
+    def test_applies_settings(self):
+        changes = []
+        config.on_reload(lambda old, new: changes.append(
+            (old.SCHEDULER_CONCURRENCY, new.SCHEDULER_CONCURRENCY)))
+        before = config.SCHEDULER_CONCURRENCY
+        self.edit(r'^concurrency: \d+', 'concurrency: 3')
+
+        self.assertEqual(config.load(self.path), [])
+        self.assertEqual(config.SCHEDULER_CONCURRENCY, 3)
+        self.assertEqual(changes, [(before, 3)])
+
+    def test_keeps_restart_required(self):
+        enabled = config.COMPONENT_ENABLED
+        self.edit(r'^enabled: \w+', 'enabled: %s' % ('no' if enabled
+                                                     else 'yes'))
+
+        self.assertEqual(config.load(self.path), ['COMPONENT_ENABLED'])
+        self.assertEqual(config.COMPONENT_ENABLED, enabled)
+        self.assertEqual(config.settings.COMPONENT_ENABLED, enabled)
+        # Still pending on the next reload
+        self.assertEqual(config.load(self.path), ['COMPONENT_ENABLED'])
+
+    def test_broken_file_keeps_settings(self):
+        settings = config.settings
+        self.edit(r'^\[smtp\]', '[smtpx]')
+
+        self.assertRaises(Exception, config.load, self.path)
+        self.assertIdentical(config.settings, settings)
+
+    def test_rejects_zero_broadcast_rate(self):
+        self.edit(r'^broadcast_rate: .*', 'broadcast_rate: 0')
+        self.assertRaises(ValueError, config.load, self.path)
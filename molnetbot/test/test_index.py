@@ -0,0 +1,116 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+The MIT license
+
+Copyright (c) 2010 Jonas Nockert
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+---
+
+
+Tests for molnetbot.index.
+
+"""
+import json
+
+from twisted.internet import defer, task
+from twisted.trial import unittest
+
+from molnetbot.index import DirectoryIndex, DirectorySync
+
+
+PEOPLE = [{'id': 1, 'name': u"Åsa Öberg", 'title': u"Developer"},
+          {'id': 2, 'name': u"Anna Berg", 'title': u"Designer"},
+          {'id': 3, 'name': u"Anders Dahl", 'title': u"Director"}]
+
+
+class DirectoryIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = DirectoryIndex()
+        self.index.load(PEOPLE)
+
+    def names(self, query):
+        return [hit['name'] for hit in self.index.search(query)]
+
+    def test_prefixes_sorted_by_name(self):
+        self.assertEqual(self.names(u"an"), [u"Anders Dahl", u"Anna Berg"])
+        self.assertEqual(self.names(u"asa oberg"), [u"Åsa Öberg"])
+        self.assertEqual(self.names(u"d"), [])
+        self.assertEqual(self.names(u"de berg"), [u"Anna Berg"])
+        self.assertEqual(self.names(u"di"), [u"Anders Dahl"])
+
+    def test_update(self):
+        self.index.update([{'id': 2, 'name': u"Zara Berg"}], [3])
+        self.assertEqual(self.names(u"berg"), [u"Zara Berg"])
+        self.assertEqual(self.names(u"dahl"), [])
+
+
+class FakeClient(object):
+
+    def __init__(self):
+        self.requests = []
+
+    def get(self, url):
+        d = defer.Deferred()
+        self.requests.append((url, d))
+        return d
+
+
+class DirectorySyncTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.client = FakeClient()
+        self.sync = DirectorySync(self.client, 'http://molnet/people', 60,
+                                  clock=self.clock)
+        # Skip building the first index in a thread
+        self.sync.index = DirectoryIndex()
+        self.sync.cursor = 'c0'
+
+    def answer(self, cursor):
+        url, d = self.client.requests[-1]
+        d.callback(json.dumps({'people': [], 'cursor': cursor}))
+
+    def test_set_interval_during_sync(self):
+        """
+        Changing the interval while a pull is running doesn't start
+        another one next to it, and the next pull uses the new interval.
+
+        """
+        self.sync.start()
+        self.assertEqual(len(self.client.requests), 1)
+
+        self.sync.set_interval(10)
+        self.clock.advance(60)
+        self.assertEqual(len(self.client.requests), 1)
+
+        self.answer('c1')
+        self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+        self.clock.advance(10)
+        self.assertEqual(len(self.client.requests), 2)
+        self.assertIn('since=c1', self.client.requests[-1][0])
+
+    def test_set_interval_when_idle(self):
+        self.sync.start()
+        self.answer('c1')
+        self.sync.set_interval(10)
+        self.clock.advance(10)
+        self.assertEqual(len(self.client.requests), 2)
@@ -0,0 +1,96 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+The MIT license
+
+Copyright (c) 2010 Jonas Nockert
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+---
+
+
+Tests for molnetbot.molnetbot.
+
+"""
+import os
+
+from twisted.trial import unittest
+from twisted.words.xish import domish
+
+from molnetbot import config
+from molnetbot.molnetbot import QueryHandler
+
+
+SAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      '..', '..', 'molnetbot.conf.sample')
+
+
+class FakeNotifier(object):
+
+    def notify(self, kind, content, query=None, urgent=False):
+        pass
+
+
+class MoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.addCleanup(setattr, config, 'settings', config.settings)
+        config.settings = None
+        config.load(SAMPLE)
+        self.patch(config, 'CACHE_STORE_PATH', '')
+        self.patch(config, 'INDEX_ENABLED', False)
+        self.patch(config, 'RESULTS_PAGE_SIZE', 2)
+        self.handler = QueryHandler(FakeNotifier())
+        self.sent = []
+        self.handler.send = self.sent.append
+
+    def bodies(self):
+        bodies = []
+        for xml in self.sent:
+            stream = domish.elementStream()
+            stream.DocumentStartEvent = lambda root: None
+            stream.ElementEvent = lambda element: bodies.append(
+                unicode(element.body))
+            stream.parse("<stream xmlns='jabber:client'>" + xml)
+        del self.sent[:]
+        return bodies
+
+    def hits(self, *names):
+        return [{'name': name} for name in names]
+
+    def test_more_per_query(self):
+        """
+        Every query of a multi-line message keeps its own rest, and
+        "more" continues the query answered last.
+
+        """
+        sender, recipient = 'user@example.com/home', 'bot@example.com'
+        self.handler._answer_query(self.hits(u'A1', u'A2', u'A3'), u'a',
+                                   sender, recipient)
+        self.handler._answer_query(self.hits(u'B1', u'B2', u'B3'), u'b',
+                                   sender, recipient)
+        self.assertIn(u"1 more found for 'a'. Send 'more' to see them.",
+                      self.bodies())
+
+        self.handler._more(sender, recipient)
+        self.assertEqual(self.bodies(), [u'B3'])
+        self.handler._more(sender, recipient)
+        self.assertEqual(self.bodies(), [u'A3'])
+        self.handler._more(sender, recipient)
+        self.assertEqual(self.bodies(), [u"There is nothing more to show."])
@@ -0,0 +1,72 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+The MIT license
+
+Copyright (c) 2010 Jonas Nockert
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+---
+
+
+Tests for molnetbot.profiling.
+
+"""
+import os
+
+from twisted.internet import task
+from twisted.trial import unittest
+
+from molnetbot.profiling import Profiler
+
+
+class ProfilerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = os.path.abspath(self.mktemp())
+        os.makedirs(self.directory)
+        self.clock = task.Clock()
+        self.profiler = Profiler(self.directory, clock=self.clock)
+
+    def test_command_answers_at_once(self):
+        """
+        The command answers before the session ends and the stats file
+        is written when it does.
+
+        """
+        answer = self.profiler.command('admin@example.com', '5')
+        self.assertEqual(answer, "Profiling for 5 s, output in %s" %
+                         self.directory)
+        self.assertEqual(os.listdir(self.directory), [])
+        self.assertEqual(self.profiler.command('admin@example.com', '5'),
+                         "A profiling session is already running.")
+
+        self.clock.advance(5)
+        files = os.listdir(self.directory)
+        self.assertEqual(len(files), 1)
+        self.assertTrue(files[0].endswith('.pstats'))
+
+    def test_command_limits_seconds(self):
+        """The session length is limited to C{max_seconds}."""
+
+        answer = self.profiler.command('admin@example.com', '100000')
+        self.assertEqual(answer, "Profiling for %d s, output in %s" %
+                         (Profiler.max_seconds, self.directory))
+        self.clock.advance(Profiler.max_seconds)
+        self.assertEqual(len(os.listdir(self.directory)), 1)
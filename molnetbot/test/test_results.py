@@ -0,0 +1,66 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+The MIT license
+
+Copyright (c) 2010 Jonas Nockert
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+---
+
+
+Tests for molnetbot.results and molnetbot.batching.
+
+"""
+from twisted.internet import defer, task
+from twisted.trial import unittest
+
+from molnetbot.batching import MissingResult, QueryBatcher
+from molnetbot.results import parse_batch_results
+
+
+class ParseBatchResultsTest(unittest.TestCase):
+
+    def test_hits_per_query(self):
+        results = parse_batch_results('[[{"name": "Anna"}], []]',
+                                      [u'anna', u'nobody'])
+        self.assertEqual(results, {u'anna': [{u'name': u'Anna'}],
+                                   u'nobody': []})
+
+    def test_leaves_out_missing(self):
+        results = parse_batch_results('[null, {"error": "x"}, []]',
+                                      [u'a', u'b', u'c', u'd'])
+        self.assertEqual(results, {u'c': []})
+
+
+class QueryBatcherTest(unittest.TestCase):
+
+    def test_fails_queries_without_result(self):
+        clock = task.Clock()
+        batcher = QueryBatcher(
+            lambda queries: defer.succeed(
+                parse_batch_results('[[], null]', queries)),
+            0.01, 10, clock)
+        found = batcher.submit(u'a')
+        missing = batcher.submit(u'b')
+        clock.advance(0.01)
+
+        self.assertEqual(self.successResultOf(found), [])
+        self.failureResultOf(missing, MissingResult)
+        self.assertEqual(batcher.stats['missing'], 1)
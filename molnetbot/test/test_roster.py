@@ -0,0 +1,67 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+The MIT license
+
+Copyright (c) 2010 Jonas Nockert
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+---
+
+
+Tests for molnetbot.roster.
+
+"""
+from twisted.internet import task
+from twisted.trial import unittest
+
+from molnetbot.roster import PacedBroadcast, RosterStore
+
+
+class PacedBroadcastTest(unittest.TestCase):
+
+    def test_batches(self):
+        clock = task.Clock()
+        sent = []
+        broadcast = PacedBroadcast(['<a/>'] * 25, sent.append, rate=50,
+                                   batch_size=10, clock=clock)
+        d = broadcast.start()
+        clock.advance(0.2)
+        clock.advance(0.2)
+        self.assertEqual([len(batch) / 4 for batch in sent], [10, 10, 5])
+        self.assertEqual(self.successResultOf(d), 25)
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, PacedBroadcast, [], None, 0, 10)
+        self.assertRaises(ValueError, PacedBroadcast, [], None, 50, 0)
+
+
+class RosterStoreTest(unittest.TestCase):
+
+    def test_memory(self):
+        clock = task.Clock()
+        roster = RosterStore(clock=clock)
+        roster.add('a@example.com', 'bot.example.com')
+        clock.advance(120)
+        roster.seen('a@example.com')
+        roster.seen('b@example.com')
+        self.assertEqual(self.successResultOf(roster.when_loaded()),
+                         {'a@example.com': ['bot.example.com', 120]})
+        roster.remove('a@example.com')
+        self.assertEqual(len(roster), 0)
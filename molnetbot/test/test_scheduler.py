@@ -0,0 +1,86 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+The MIT license
+
+Copyright (c) 2010 Jonas Nockert
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+---
+
+
+Tests for molnetbot.scheduler.
+
+"""
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from molnetbot.scheduler import QueryScheduler, QueueFull
+
+
+class QuerySchedulerTest(unittest.TestCase):
+
+    def test_limits_concurrency(self):
+        scheduler = QueryScheduler(2, 10)
+        calls = [defer.Deferred() for i in range(3)]
+        results = [scheduler.submit(lambda d=d: d) for d in calls]
+        self.assertEqual(scheduler.running, 2)
+        self.assertEqual(scheduler.depth(), 1)
+
+        calls[0].callback('a')
+        self.assertEqual(self.successResultOf(results[0]), 'a')
+        self.assertEqual(scheduler.running, 2)
+        self.assertEqual(scheduler.depth(), 0)
+
+    def test_rejects_when_full(self):
+        scheduler = QueryScheduler(1, 1)
+        scheduler.submit(defer.Deferred)
+        scheduler.submit(defer.Deferred)
+        self.failureResultOf(scheduler.submit(defer.Deferred), QueueFull)
+        self.assertEqual(scheduler.stats['rejected'], 1)
+
+    def test_drains_synchronous_failures(self):
+        """
+        A long queue of calls failing right away, as with an open
+        circuit breaker, is drained without recursing.
+
+        """
+        scheduler = QueryScheduler(2, 1000)
+        blockers = [defer.Deferred(), defer.Deferred()]
+        for blocker in blockers:
+            scheduler.submit(lambda blocker=blocker: blocker)
+        queued = [scheduler.submit(defer.fail, ValueError())
+                  for i in range(800)]
+        self.assertEqual(scheduler.depth(), 800)
+
+        for blocker in blockers:
+            blocker.callback(None)
+        for d in queued:
+            self.failureResultOf(d, ValueError)
+        self.assertEqual(scheduler.running, 0)
+        self.assertEqual(scheduler.depth(), 0)
+
+    def test_resize_starts_queued(self):
+        scheduler = QueryScheduler(1, 10)
+        scheduler.submit(defer.Deferred)
+        queued = scheduler.submit(defer.succeed, 'b')
+        self.assertNoResult(queued)
+
+        scheduler.resize(2, 10)
+        self.assertEqual(self.successResultOf(queued), 'b')
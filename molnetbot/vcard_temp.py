@@ -27,35 +27,115 @@ THE SOFTWARE.
 
 Send a vCard to servers handling xmpp extension XEP-0054: vCard-temp
 
+The hash of the avatar is advertised in presence as described in
+XEP-0153: vCard-Based Avatars.
+
 """
+import base64
+import hashlib
+import json
+import os
 import sys
 
+from twisted.python import log
 from twisted.words.xish import domish
+from wokkel.generic import Request
+from wokkel.subprotocols import XMPPHandler
+
+
+NS_VCARD = 'vcard-temp'
+NS_VCARD_UPDATE = 'vcard-temp:x:update'
+
+
+class VCardRequest(Request):
+    """Request to get our vCard, or to set it to the given payload."""
+
+    timeout = 30
+
+    def __init__(self, stanzaType='get', payload=None):
+        Request.__init__(self, stanzaType=stanzaType)
+        self.payload = payload
+
+    def toElement(self):
+        element = Request.toElement(self)
+        vcard = element.addElement((NS_VCARD, 'vCard'))
+        if self.payload:
+            vcard.addRawXml(self.payload)
+        return element
+
+
+class VCardTemp(XMPPHandler):
+    """
+    Publishes our vCard, including avatar.
 
-import config
+    The vCard payload and the SHA-1 hash of the avatar are computed once
+    and cached on disk in C{cache_path}, keyed by the modification time
+    of the image.
 
+    As soon as the session is up, the vCard on the server is fetched and
+    ours is only uploaded if the avatar differs. The avatar hash is added
+    to all available presence we send so that clients only fetch the
+    vCard when the avatar changes.
 
-class VCardTemp(object):
-    def __init__(self, xmppclient):
+    Should be added right after L{OutboundQueue}, before handlers that
+    send presence.
+
+    """
+    def __init__(self, cache_path=None, publish=True):
+        XMPPHandler.__init__(self)
         # TODO: Initialize vCard properties from config
-        self.xmppclient = xmppclient
-        self.image = None
-        self.mime_type = None
+        self.cache_path = cache_path
+        self.publish = publish
+        self.payload = None
+        self.photo_hash = None
         self.full_name = "Molnet"
         self.nickname = "Molnet"
         self.url = "http://molnet/"
         self.description = "Who? Me?"
+        self.stats = {'published': 0,
+                      'unchanged': 0}
+
+    def _fields(self):
+        return [self.full_name, self.nickname, self.url, self.description]
 
     def set_image(self, path):
         """Set avatar image given a path to an image."""
 
-        try:
+        mtime = os.stat(path).st_mtime
+        cached = self._load_cache(path, mtime)
+        if cached is None:
             image, mime_type = self.get_image_and_mime_type(path)
-        except:
-            raise
-
-        self.image = image
-        self.mime_type = mime_type
+            cached = {'path': path,
+                      'mtime': mtime,
+                      'fields': self._fields(),
+                      'hash': hashlib.sha1(image).hexdigest(),
+                      'payload': self._build_payload(image, mime_type)}
+            self._save_cache(cached)
+
+        self.photo_hash = cached['hash']
+        self.payload = cached['payload']
+
+    def _load_cache(self, path, mtime):
+        if not self.cache_path:
+            return None
+        try:
+            with open(self.cache_path) as f:
+                cached = json.load(f)
+        except (IOError, ValueError):
+            return None
+        if cached.get('path') != path or cached.get('mtime') != mtime \
+                or cached.get('fields') != self._fields():
+            return None
+        return cached
+
+    def _save_cache(self, cached):
+        if not self.cache_path:
+            return
+        try:
+            with open(self.cache_path, 'w') as f:
+                json.dump(cached, f)
+        except IOError as e:
+            log.msg("Failed to cache vCard: %s" % e)
 
     def get_image_and_mime_type(self, path):
         """
@@ -92,13 +172,8 @@ class VCardTemp(object):
 
         return (image, mime_type)
 
-    def send(self):
-        """Sends a vcard-temp set request to the xmpp server."""
-
-        if not self.image or not self.mime_type:
-            raise ValueError, "Image not initialized yet."
-
-        xml = """\
+    def _build_payload(self, image, mime_type):
+        return """\
 <FN>%(full_name)s</FN>
 <NICKNAME>%(nickname)s</NICKNAME>
 <URL>%(url)s</URL>
@@ -109,12 +184,55 @@ class VCardTemp(object):
 <DESC>%(description)s</DESC>""" % {'full_name': self.full_name,
                                    'nickname': self.nickname,
                                    'url': self.url,
-                                   'b64image': self.image.encode('base64'),
-                                   'mime_type': self.mime_type,
+                                   'b64image': base64.b64encode(image),
+                                   'mime_type': mime_type,
                                    'description': self.description}
 
-        vcard_temp = domish.Element((None, 'iq'))
-        vcard_temp['type'] = 'set'
-        vcard_wrapper = vcard_temp.addElement('vCard', 'vcard-temp')
-        vcard_wrapper.addRawXml(xml)
-        self.xmppclient.send(vcard_temp)
+    def connectionInitialized(self):
+        if self.photo_hash is None:
+            return
+
+        # Add the avatar hash to available presence sent from now on
+        send = self.xmlstream.send
+
+        def send_with_hash(obj):
+            if domish.IElement.providedBy(obj) and obj.name == 'presence' \
+                    and not obj.getAttribute('type'):
+                update = obj.addElement((NS_VCARD_UPDATE, 'x'))
+                update.addElement('photo', content=self.photo_hash)
+            send(obj)
+
+        self.xmlstream.send = send_with_hash
+
+        if self.publish:
+            d = self.request(VCardRequest())
+            d.addCallbacks(self._published_hash, lambda failure: None)
+            d.addCallback(self._publish_if_changed)
+            d.addErrback(log.err, "Failed to publish vCard")
+
+    def _published_hash(self, iq):
+        """Hash of the avatar in the vCard stored on the server."""
+
+        for vcard in iq.elements(NS_VCARD, 'vCard'):
+            for photo in vcard.elements(NS_VCARD, 'PHOTO'):
+                for binval in photo.elements(NS_VCARD, 'BINVAL'):
+                    try:
+                        image = base64.b64decode(
+                            ''.join(unicode(binval).split()).encode('ascii'))
+                    except (TypeError, UnicodeError):
+                        return None
+                    return hashlib.sha1(image).hexdigest()
+        return None
+
+    def _publish_if_changed(self, published_hash):
+        if published_hash == self.photo_hash:
+            self.stats['unchanged'] += 1
+            log.msg("vCard on server is up to date.")
+            return
+        d = self.request(VCardRequest('set', self.payload))
+        d.addCallback(self._published)
+        return d
+
+    def _published(self, iq):
+        self.stats['published'] += 1
+        log.msg("Published vCard.")
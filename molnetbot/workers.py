@@ -0,0 +1,147 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+The MIT license
+
+Copyright (c) 2010 Jonas Nockert
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+---
+
+
+Running the bot as several worker processes.
+
+Each worker is a separate process connected as its own resource of the
+bot's JID, e.g. molnet@xmppserver/Hello-0 and molnet@xmppserver/Hello-1.
+Every user is handled by one worker, picked by rendezvous hashing of the
+user's bare JID, so that adding or removing a worker only moves the
+users of that worker.
+
+Worker 0 announces a higher presence priority than the others so that
+the server delivers messages sent to the bare JID to it. Messages from
+users handled by other workers are forwarded to them, wrapped as
+described in U{XEP-0297<http://xmpp.org/extensions/xep-0297.html>}. The
+owner answers from its own full JID and clients keep sending to that
+resource after the first reply.
+
+"""
+import hashlib
+
+from twisted.python import log
+from twisted.words.protocols.jabber import jid
+from twisted.words.xish import domish
+from wokkel.subprotocols import XMPPHandler
+
+
+NS_FORWARD = 'urn:xmpp:forward:0'
+FORWARDED = '/message/forwarded[@xmlns="' + NS_FORWARD + '"]'
+
+
+def owner(entity, count):
+    """Index of the worker handling entity, out of count workers."""
+
+    if count <= 1:
+        return 0
+    bare = entity.userhost().encode('utf-8')
+    return max(xrange(count),
+               key=lambda index: hashlib.md5('%d %s' % (index, bare)).digest())
+
+
+def worker_jid(entity, index, count):
+    """The JID worker index connects as, given the bot's JID."""
+
+    if count <= 1:
+        return entity
+    return jid.JID(tuple=(entity.user, entity.host,
+                          u"%s-%d" % (entity.resource or u"molnetbot", index)))
+
+
+def priority(index):
+    """Presence priority of worker index."""
+
+    return 1 if index == 0 else 0
+
+
+class WorkerRouter(XMPPHandler):
+    """
+    Routes stanzas from users to the worker handling them.
+
+    Handlers check L{owns} before acting on a stanza. Messages for other
+    workers are passed to L{forward}. Forwarded messages from other
+    workers are unwrapped and dispatched on our stream as if they had
+    been received directly.
+
+    """
+    def __init__(self, entity, index, count):
+        XMPPHandler.__init__(self)
+        self.entity = entity
+        self.index = index
+        self.count = count
+        self.stats = {'forwarded': 0,
+                      'received': 0}
+
+    def connectionInitialized(self):
+        self.xmlstream.addObserver(FORWARDED, self.onForwarded, priority=1)
+
+    def owns(self, entity):
+        """Whether entity is handled by this worker."""
+
+        return owner(entity, self.count) == self.index
+
+    def route(self, message):
+        """
+        Forward message if its sender is handled by another worker.
+
+        Returns whether the message was forwarded. Messages that were
+        forwarded to us are never forwarded again, even if the workers
+        disagree on the number of workers.
+
+        """
+        if message.routed or self.owns(jid.internJID(message['from'])):
+            return False
+        self.forward(message)
+        return True
+
+    def forward(self, message):
+        """Forward message to the worker handling its sender."""
+
+        index = owner(jid.internJID(message['from']), self.count)
+        wrapper = domish.Element((None, 'message'))
+        wrapper['to'] = worker_jid(self.entity, index, self.count).full()
+        wrapper['type'] = 'normal'
+        wrapper.addElement((NS_FORWARD, 'forwarded')).addChild(message)
+        self.send(wrapper)
+        self.stats['forwarded'] += 1
+
+    def onForwarded(self, wrapper):
+        """Unwrap and dispatch a message forwarded by another worker."""
+
+        wrapper.handled = True
+        sender = jid.internJID(wrapper.getAttribute('from', ''))
+        if sender.userhost() != self.entity.userhost():
+            log.msg("Ignoring forwarded message from %s" % sender.full())
+            return
+        for message in wrapper.forwarded.elements():
+            if message.name != 'message':
+                continue
+            message.parent = None
+            message['to'] = wrapper['to']
+            message.routed = True
+            self.stats['received'] += 1
+            self.xmlstream.dispatch(message)
@@ -31,9 +31,11 @@ XEP-0012: Last Activity handler
 from datetime import datetime
 import time
 
-from twisted.words.protocols.jabber.xmlstream import toResponse
+from twisted.words.xish import domish
 from wokkel.subprotocols import IQHandlerMixin, XMPPHandler
 
+import metrics
+
 
 NS_LAST_ACTIVITY = 'jabber:iq:last'
 LAST_ACTIVITY = '/iq[@type="get"]/query[@xmlns="' + NS_LAST_ACTIVITY +'"]'
@@ -46,6 +48,9 @@ class LastActivityHandler(XMPPHandler, IQHandlerMixin):
     This protocol is described in
     U{XEP-0012<http://www.xmpp.org/extensions/xep-0012.html>}.
 
+    get_last returns the number of seconds we've been idle, see
+    L{ActivityTracker.idle}.
+
     """
     iqHandlers = {LAST_ACTIVITY: 'onLastActivityGet'}
 
@@ -55,14 +60,10 @@ class LastActivityHandler(XMPPHandler, IQHandlerMixin):
     def connectionInitialized(self):
         self.xmlstream.addObserver(LAST_ACTIVITY, self.handleRequest)
 
+    @metrics.timed('molnetbot_iq_last_activity')
     def onLastActivityGet(self, iq):
         """Handle a request for last activity."""
 
-        response = toResponse(iq, 'result')
-        # TODO: Replace 'hello world!' string with something proper.
-        query = response.addElement((NS_LAST_ACTIVITY, 'query'),
-                                    content="Hello world!")
-        query['seconds'] = str(self.get_last())
-
-        self.send(response)
-        iq.handled = True
+        query = domish.Element((NS_LAST_ACTIVITY, 'query'))
+        query['seconds'] = str(int(self.get_last()))
+        return query
@@ -30,9 +30,11 @@ XEP-0202: Entity Time handler
 from datetime import datetime
 import time
 
-from twisted.words.protocols.jabber.xmlstream import toResponse
+from twisted.words.xish import domish
 from wokkel.subprotocols import IQHandlerMixin, XMPPHandler
 
+import metrics
+
 
 NS_ENTITY_TIME = 'urn:xmpp:time'
 ENTITY_TIME = '/iq[@type="get"]/time[@xmlns="' + NS_ENTITY_TIME +'"]'
@@ -51,19 +53,18 @@ class EntityTimeHandler(XMPPHandler, IQHandlerMixin):
     def connectionInitialized(self):
         self.xmlstream.addObserver(ENTITY_TIME, self.handleRequest)
 
+    @metrics.timed('molnetbot_iq_entity_time')
     def onEntityTimeGet(self, iq):
         """Handle a request for entity time."""
 
-        response = toResponse(iq, 'result')
-        entity_time = response.addElement((NS_ENTITY_TIME, 'time'))
+        entity_time = domish.Element((NS_ENTITY_TIME, 'time'))
 
         tzo_str = self._get_timezone_offset_str()
         utc_str = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
         tzo = entity_time.addElement('tzo', content=tzo_str)
         utc = entity_time.addElement('utc', content=utc_str)
 
-        self.send(response)
-        iq.handled = True
+        return entity_time
 
     def _get_timezone_offset_str(self, timestamp=None):
         """Creates a time zone offset string.